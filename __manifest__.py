@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 {
     'name': 'Supply Chain Management',
-    'version': '17.0.1.0.0',
+    'version': '17.0.1.1.0',
     'category': 'Inventory/Purchase',
     'summary': 'Advanced supply chain management with PR consolidation',
     'description': """
@@ -32,6 +32,7 @@ This module extends Odoo's procurement capabilities with:
         # Models and Data
         'data/scm_sequence.xml',
         'data/scm_inventory_data.xml',
+        'data/scm_cron.xml',
         
         # Views
         'views/scm_consolidation_views.xml',
@@ -40,6 +41,8 @@ This module extends Odoo's procurement capabilities with:
         'views/scm_inventory_rule_views.xml',
         'views/scm_forecast_views.xml',
         'views/purchase_order_views.xml',
+        'views/stock_quant_views.xml',
+        'views/res_company_views.xml',
         
         # Wizards
         'wizards/validate_inventory_wizard_views.xml',
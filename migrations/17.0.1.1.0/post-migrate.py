@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+
+from odoo import api, SUPERUSER_ID
+
+
+def migrate(cr, version):
+    """Fill the tables and counters added in this version from the existing data"""
+    if not version:
+        return
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    env['scm.consumption.daily']._rebuild()
+    # The stored fulfillment counters start at 0, backfill them before the
+    # incremental updates apply deltas on top
+    env['purchase.request']._rebuild_fulfillment_status()
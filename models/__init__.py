@@ -2,10 +2,20 @@
 
 # Base models
 from . import scm_consolidation
+from . import scm_consolidation_job
 from . import scm_consolidated_line
 from . import scm_inventory_rule
+from . import scm_inventory_snapshot
+from . import scm_inventory_projection
+from . import scm_consumption_daily
+from . import scm_vendor_index
+from . import scm_price_matrix
 from . import scm_forecast
+from . import scm_forecast_engine
 from . import stock_quant
+from . import stock_move
+from . import scm_perf_trace
+from . import res_company
 
 # Purchase related models
 from . import purchase_request
@@ -2,6 +2,8 @@ from odoo import models, fields, api, _
 from odoo.exceptions import UserError, ValidationError
 from datetime import datetime, date
 
+from .purchase_order import AGREEMENT_PRICES_KEY
+
 
 class PurchaseRequisition(models.Model):
     _inherit = 'purchase.requisition'
@@ -73,11 +75,50 @@ class PurchaseRequisitionLine(models.Model):
     price_subtotal = fields.Monetary(string='Subtotal', compute='_compute_price_subtotal', store=True)
     currency_id = fields.Many2one(related='requisition_id.currency_id', string='Currency', store=True)
     
+    @api.model_create_multi
+    def create(self, vals_list):
+        self.env.cr.precommit.data.pop(AGREEMENT_PRICES_KEY, None)
+        return super(PurchaseRequisitionLine, self).create(vals_list)
+    
+    def write(self, vals):
+        if {'requisition_id', 'product_id', 'price_unit', 'product_uom_id'} & set(vals):
+            # The cached blanket order prices are outdated
+            self.env.cr.precommit.data.pop(AGREEMENT_PRICES_KEY, None)
+        return super(PurchaseRequisitionLine, self).write(vals)
+    
+    def unlink(self):
+        self.env.cr.precommit.data.pop(AGREEMENT_PRICES_KEY, None)
+        return super(PurchaseRequisitionLine, self).unlink()
+    
     @api.depends('price_unit', 'product_qty')
     def _compute_price_subtotal(self):
         for line in self:
             line.price_subtotal = line.price_unit * line.product_qty
     
+    @api.onchange('product_id')
+    def _onchange_product_vendor_price(self):
+        """Default the unit price from the price list of the agreement vendor"""
+        self._set_vendor_price()
+
+    @api.onchange('product_qty')
+    def _onchange_qty_vendor_price(self):
+        """Fill a missing unit price, keeping a negotiated one"""
+        self.filtered(lambda l: not l.price_unit)._set_vendor_price()
+
+    def _set_vendor_price(self):
+        lines = self.filtered(lambda l: l.product_id and l.requisition_id.vendor_id)
+        if not lines:
+            return
+        PriceMatrix = self.env['scm.price.matrix']
+        matrix = PriceMatrix.get_matrix(lines.mapped('product_id'))
+        for line in lines:
+            entry = PriceMatrix.best_price(
+                matrix, line.product_id, line.product_qty,
+                line.requisition_id.date_start, line.requisition_id.vendor_id
+            )
+            if entry:
+                line.price_unit = entry['price']
+    
     @api.constrains('min_qty', 'max_qty')
     def _check_quantities(self):
         for line in self:
@@ -1,6 +1,9 @@
 from odoo import models, fields, api, _
 from odoo.exceptions import UserError
 
+# Transaction cache of the blanket order prices, see _get_agreement_prices
+AGREEMENT_PRICES_KEY = 'scm_procurement.agreement_prices'
+
 class PurchaseOrder(models.Model):
     _inherit = 'purchase.order'
 
@@ -63,6 +66,30 @@ class PurchaseOrder(models.Model):
         for order in self:
             order.is_from_agreement = bool(order.requisition_id)
 
+    def _get_agreement_prices(self):
+        """Unit prices of the blanket orders of the orders.
+
+        Returns a dict {requisition_id: {product_id: (price_unit, uom_id)}},
+        where the first agreement line of a product wins and uom_id is False
+        for lines without a unit of measure. Each blanket order
+        is loaded once and kept until the end of the transaction.
+        """
+        prices = self.env.cr.precommit.data.setdefault(AGREEMENT_PRICES_KEY, {})
+        missing_ids = [requisition_id for requisition_id in self.requisition_id.ids if requisition_id not in prices]
+        if missing_ids:
+            for requisition_id in missing_ids:
+                prices[requisition_id] = {}
+            # Latest lines first, so that the first line of a product is kept
+            for line in self.env['purchase.requisition.line'].search_read(
+                [('requisition_id', 'in', missing_ids)],
+                ['requisition_id', 'product_id', 'price_unit', 'product_uom_id'],
+                order='id desc',
+            ):
+                prices[line['requisition_id'][0]][line['product_id'][0]] = (
+                    line['price_unit'], line['product_uom_id'] and line['product_uom_id'][0]
+                )
+        return prices
+
     def action_view_consolidation(self):
         self.ensure_one()
         if self.consolidation_id:
@@ -207,29 +234,3 @@ class PurchaseOrderRejectWizard(models.TransientModel):
             'rejection_reason': self.rejection_reason
         })
         return {'type': 'ir.actions.act_window_close'}
-
-    # Override the standard price computation to consider blanket order prices
-    @api.depends('order_line.price_unit', 'order_line.product_qty')
-    def _compute_amount_total(self):
-        for order in self:
-            amount_untaxed = 0.0
-            amount_tax = 0.0
-            
-            for line in order.order_line:
-                # Check if there's a blanket order line with a specific price
-                if order.requisition_id:
-                    blanket_line = self.env['purchase.requisition.line'].search([
-                        ('requisition_id', '=', order.requisition_id.id),
-                        ('product_id', '=', line.product_id.id)
-                    ], limit=1)
-                    
-                    if blanket_line:
-                        # Use the blanket order price
-                        line.price_unit = blanket_line.price_unit
-                
-                amount_untaxed += line.price_subtotal
-                amount_tax += line.price_tax
-            
-            order.amount_untaxed = amount_untaxed
-            order.amount_tax = amount_tax
-            order.amount_total = amount_untaxed + amount_tax
\ No newline at end of file
@@ -23,6 +23,29 @@ class PurchaseOrderLine(models.Model):
         for line in self:
             line.is_from_agreement = bool(line.requisition_line_id)
     
+    def _get_agreement_price(self, prices):
+        """Blanket order price of the line in its unit of measure, or None,
+        from the prices returned by purchase.order._get_agreement_prices"""
+        agreement_price = prices.get(self.order_id.requisition_id.id, {}).get(self.product_id.id)
+        if not agreement_price or not self.product_uom:
+            return None
+        price_unit, uom_id = agreement_price
+        # Agreement lines without a unit of measure are in the product's one
+        uom = self.env['uom.uom'].browse(uom_id) if uom_id else self.product_id.uom_id
+        return uom._compute_price(price_unit, self.product_uom)
+    
+    def _compute_price_unit_and_date_planned_and_name(self):
+        super(PurchaseOrderLine, self)._compute_price_unit_and_date_planned_and_name()
+        # Blanket order prices prevail, resolved once for all the orders
+        prices = self.order_id._get_agreement_prices()
+        for line in self:
+            # Same lines as skipped by the standard computation
+            if not line.product_id or line.invoice_lines or not line.company_id:
+                continue
+            price_unit = line._get_agreement_price(prices)
+            if price_unit is not None:
+                line.price_unit = price_unit
+    
     # Override the standard price computation to consider purchase agreement prices
     @api.onchange('product_id', 'product_qty')
     def _onchange_product_id(self):
@@ -2,6 +2,20 @@
 
 from odoo import models, fields, api, _
 from odoo.exceptions import UserError
+from odoo.tools import split_every
+import logging
+
+_logger = logging.getLogger(__name__)
+
+# Counter of the request lines in each fulfillment status
+FULFILLMENT_COUNTERS = {
+    'not_included': 'fulfillment_not_included_count',
+    'pending': 'fulfillment_pending_count',
+    'in_progress': 'fulfillment_in_progress_count',
+    'partially_fulfilled': 'fulfillment_partial_count',
+    'fulfilled': 'fulfillment_fulfilled_count',
+    'cancelled': 'fulfillment_cancelled_count',
+}
 
 
 class PurchaseRequest(models.Model):
@@ -58,6 +72,14 @@ class PurchaseRequest(models.Model):
         compute='_compute_expected_fulfillment_date'
     )
     
+    # Lines per fulfillment status, maintained as deltas by the request lines
+    fulfillment_not_included_count = fields.Integer(readonly=True)
+    fulfillment_pending_count = fields.Integer(readonly=True)
+    fulfillment_in_progress_count = fields.Integer(readonly=True)
+    fulfillment_partial_count = fields.Integer(readonly=True)
+    fulfillment_fulfilled_count = fields.Integer(readonly=True)
+    fulfillment_cancelled_count = fields.Integer(readonly=True)
+    
     consolidation_count = fields.Integer(
         string='Consolidations',
         compute='_compute_consolidation_count'
@@ -83,27 +105,126 @@ class PurchaseRequest(models.Model):
         for record in self:
             record.consolidation_count = len(record.consolidation_ids)
     
-    @api.depends('line_ids.fulfillment_status')
+    @api.depends('consolidation_ids', *FULFILLMENT_COUNTERS.values())
     def _compute_fulfillment_status(self):
         for request in self:
             if not request.consolidation_ids:
                 request.fulfillment_status = 'not_included'
                 continue
-                
-            line_states = request.line_ids.mapped('fulfillment_status')
-            if not line_states or all(state == 'not_included' for state in line_states):
+            
+            line_count = sum(request[counter] for counter in FULFILLMENT_COUNTERS.values())
+            if not line_count or request.fulfillment_not_included_count == line_count:
                 request.fulfillment_status = 'not_included'
-            elif all(state == 'fulfilled' for state in line_states):
+            elif request.fulfillment_fulfilled_count == line_count:
                 request.fulfillment_status = 'fulfilled'
-            elif any(state == 'in_progress' for state in line_states):
+            elif request.fulfillment_in_progress_count:
                 request.fulfillment_status = 'in_progress'
-            elif any(state == 'partially_fulfilled' for state in line_states):
+            elif request.fulfillment_partial_count:
                 request.fulfillment_status = 'partially_fulfilled'
-            elif any(state == 'pending' for state in line_states):
+            elif request.fulfillment_pending_count:
                 request.fulfillment_status = 'pending'
             else:
                 request.fulfillment_status = 'not_included'
     
+    @api.model
+    def _apply_fulfillment_deltas(self, deltas):
+        """Add {request_id: {fulfillment_status: delta}} to the request counters"""
+        deltas = {request_id: counts for request_id, counts in deltas.items() if request_id and any(counts.values())}
+        if not deltas:
+            return
+        counters = list(FULFILLMENT_COUNTERS.values())
+        self.flush_model(counters)
+        updated_ids = []
+        for request_ids in split_every(1000, list(deltas)):
+            query = """
+                UPDATE purchase_request request
+                   SET %s
+                  FROM (VALUES %s) AS delta(id, %s)
+                 WHERE request.id = delta.id
+             RETURNING request.id
+            """ % (
+                ', '.join('%s = COALESCE(request.%s, 0) + delta.%s' % (counter, counter, counter) for counter in counters),
+                ', '.join(['(%s' + ', %s::int' * len(counters) + ')'] * len(request_ids)),
+                ', '.join(counters),
+            )
+            params = []
+            for request_id in request_ids:
+                params.append(request_id)
+                params.extend(deltas[request_id].get(status, 0) for status in FULFILLMENT_COUNTERS)
+            self.env.cr.execute(query, params)
+            updated_ids.extend(row[0] for row in self.env.cr.fetchall())
+        requests = self.browse(updated_ids)
+        requests.invalidate_recordset(counters)
+        # Recompute the fulfillment status of the requests from the new counters
+        requests.modified(counters)
+    
+    @api.model
+    def _rebuild_fulfillment_status(self, batch_size=5000, auto_commit=False):
+        """Recompute the fulfillment status of all the request lines and the
+        counters of their requests, batch by batch of requests.
+
+        Meant to backfill existing databases, from an Odoo shell::
+
+            env['purchase.request']._rebuild_fulfillment_status(auto_commit=True)
+        """
+        self.flush_model()
+        self.env['purchase.request.line'].flush_model()
+        self.env['scm.consolidated.pr.line'].flush_model(['state', 'purchase_request_line_ids'])
+        relation = self.env['purchase.request.line']._fields['consolidated_line_ids']
+        self.env.cr.execute("SELECT id FROM purchase_request ORDER BY id")
+        request_ids = [row[0] for row in self.env.cr.fetchall()]
+        for batch_ids in split_every(batch_size, request_ids):
+            batch_ids = tuple(batch_ids)
+            # Status of each line from the states of its consolidated lines
+            self.env.cr.execute("""
+                UPDATE purchase_request_line line
+                   SET fulfillment_status = status.value
+                  FROM (
+                        SELECT line.id,
+                               CASE WHEN bool_or(cl.state = 'fulfilled') THEN 'fulfilled'
+                                    WHEN bool_or(cl.state = 'po_created') THEN 'in_progress'
+                                    WHEN bool_or(cl.state IN ('po_suggested', 'validated')) THEN 'pending'
+                                    ELSE 'not_included'
+                               END AS value
+                          FROM purchase_request_line line
+                     LEFT JOIN {relation} rel ON rel.{column1} = line.id
+                     LEFT JOIN scm_consolidated_pr_line cl ON cl.id = rel.{column2}
+                         WHERE line.request_id IN %s
+                      GROUP BY line.id
+                  ) AS status
+                 WHERE status.id = line.id
+                   AND line.fulfillment_status IS DISTINCT FROM status.value
+            """.format(relation=relation.relation, column1=relation.column1, column2=relation.column2), [batch_ids])
+            # Counters of each request from the status of its lines
+            self.env.cr.execute("""
+                UPDATE purchase_request request
+                   SET %s
+                  FROM (
+                        SELECT request.id, %s
+                          FROM purchase_request request
+                     LEFT JOIN purchase_request_line line ON line.request_id = request.id
+                         WHERE request.id IN %%s
+                      GROUP BY request.id
+                  ) AS counts
+                 WHERE counts.id = request.id
+            """ % (
+                ', '.join('%s = counts.%s' % (counter, counter) for counter in FULFILLMENT_COUNTERS.values()),
+                ', '.join(
+                    "COUNT(line.id) FILTER (WHERE line.fulfillment_status = '%s') AS %s" % (status, counter)
+                    for status, counter in FULFILLMENT_COUNTERS.items()
+                ),
+            ), [batch_ids])
+            self.env['purchase.request.line'].invalidate_model(['fulfillment_status'])
+            self.invalidate_model(list(FULFILLMENT_COUNTERS.values()))
+            requests = self.browse(batch_ids)
+            requests.modified(list(FULFILLMENT_COUNTERS.values()))
+            requests.flush_recordset(['fulfillment_status'])
+            if auto_commit:
+                self.env.cr.commit()
+            self.invalidate_model()
+            _logger.info("Rebuilt fulfillment status of %d purchase requests", len(batch_ids))
+        return True
+    
     @api.depends('line_ids.expected_fulfillment_date')
     def _compute_expected_fulfillment_date(self):
         for request in self:
@@ -201,11 +322,14 @@ class PurchaseRequestLine(models.Model):
         string='Consolidated Lines'
     )
     
+    # Maintained by _update_fulfillment_status, which also keeps the
+    # counters of the requests up to date
     fulfillment_status = fields.Selection(
         selection='_get_fulfillment_status_selection',
         string='Fulfillment Status', 
-        compute='_compute_fulfillment_status', 
-        store=True
+        default='not_included',
+        readonly=True,
+        copy=False
     )
     
     expected_fulfillment_date = fields.Date(
@@ -213,25 +337,63 @@ class PurchaseRequestLine(models.Model):
         compute='_compute_expected_fulfillment_date'
     )
     
-    @api.depends('consolidated_line_ids')
-    def _compute_fulfillment_status(self):
+    @api.model
+    def _get_fulfillment_status_from_states(self, consolidated_states):
+        """Fulfillment status of a line from the states of its consolidated lines"""
         # This is a placeholder - in Phase 4, this will be based on fulfillment plans
+        if 'fulfilled' in consolidated_states:
+            return 'fulfilled'
+        elif 'po_created' in consolidated_states:
+            return 'in_progress'
+        elif 'po_suggested' in consolidated_states or 'validated' in consolidated_states:
+            return 'pending'
+        return 'not_included'
+    
+    def _update_fulfillment_status(self):
+        """Recompute the fulfillment status of the lines and apply the
+        changes as deltas to the counters of their requests"""
+        deltas = {}
+        line_ids_by_status = {}
+        for line in self.exists():
+            old_status = line.fulfillment_status or 'not_included'
+            new_status = self._get_fulfillment_status_from_states(set(line.consolidated_line_ids.mapped('state')))
+            if new_status == old_status:
+                continue
+            line_ids_by_status.setdefault(new_status, []).append(line.id)
+            request_deltas = deltas.setdefault(line.request_id.id, {})
+            request_deltas[old_status] = request_deltas.get(old_status, 0) - 1
+            request_deltas[new_status] = request_deltas.get(new_status, 0) + 1
+        for status, line_ids in line_ids_by_status.items():
+            self.browse(line_ids).write({'fulfillment_status': status})
+        self.env['purchase.request']._apply_fulfillment_deltas(deltas)
+    
+    def _get_fulfillment_deltas(self, sign):
+        """Deltas adding (sign=1) or removing (sign=-1) the lines from the
+        counters of their requests"""
+        deltas = {}
         for line in self:
-            if not line.consolidated_line_ids:
-                line.fulfillment_status = 'not_included'
-            else:
-                # For now, just link it to the consolidated line state
-                consolidated_states = line.consolidated_line_ids.mapped('state')
-                if 'fulfilled' in consolidated_states:
-                    line.fulfillment_status = 'fulfilled'
-                elif 'po_created' in consolidated_states:
-                    line.fulfillment_status = 'in_progress'
-                elif 'po_suggested' in consolidated_states:
-                    line.fulfillment_status = 'pending'
-                elif 'validated' in consolidated_states:
-                    line.fulfillment_status = 'pending'
-                else:
-                    line.fulfillment_status = 'not_included'
+            request_deltas = deltas.setdefault(line.request_id.id, {})
+            status = line.fulfillment_status or 'not_included'
+            request_deltas[status] = request_deltas.get(status, 0) + sign
+        return deltas
+    
+    @api.model_create_multi
+    def create(self, vals_list):
+        lines = super(PurchaseRequestLine, self).create(vals_list)
+        self.env['purchase.request']._apply_fulfillment_deltas(lines._get_fulfillment_deltas(1))
+        lines.filtered('consolidated_line_ids')._update_fulfillment_status()
+        return lines
+    
+    def write(self, vals):
+        if 'request_id' in vals:
+            # Move the lines from the counters of their former request
+            self.env['purchase.request']._apply_fulfillment_deltas(self._get_fulfillment_deltas(-1))
+        res = super(PurchaseRequestLine, self).write(vals)
+        if 'request_id' in vals:
+            self.env['purchase.request']._apply_fulfillment_deltas(self._get_fulfillment_deltas(1))
+        if 'consolidated_line_ids' in vals:
+            self._update_fulfillment_status()
+        return res
     
     @api.depends('consolidated_line_ids')
     def _compute_expected_fulfillment_date(self):
@@ -264,10 +426,15 @@ class PurchaseRequestLine(models.Model):
         """Control deletion of purchase request lines based on user rights and state."""
         is_admin = self.env.user._is_admin() or \
                   self.env.user.has_group('base.group_system')
+        if not is_admin:
+            for line in self:
+                if line.request_id and line.request_id.state != 'draft':
+                    raise UserError(_("You can only delete a purchase request line if the purchase request is in draft state."))
+        
+        deltas = self._get_fulfillment_deltas(-1)
         if is_admin:
-            return models.Model.unlink(self)
-            
-        for line in self:
-            if line.request_id and line.request_id.state != 'draft':
-                raise UserError(_("You can only delete a purchase request line if the purchase request is in draft state."))
-        return super(PurchaseRequestLine, self).unlink()
\ No newline at end of file
+            res = models.Model.unlink(self)
+        else:
+            res = super(PurchaseRequestLine, self).unlink()
+        self.env['purchase.request']._apply_fulfillment_deltas(deltas)
+        return res
\ No newline at end of file
@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields
+
+
+class ResCompany(models.Model):
+    _inherit = 'res.company'
+
+    scm_perf_trace_enabled = fields.Boolean(
+        string='Trace Consolidation Performance',
+        help="Record the query count and timings of each phase of the consolidation sessions"
+    )
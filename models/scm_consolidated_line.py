@@ -2,7 +2,6 @@
 
 from odoo import models, fields, api, _
 from odoo.exceptions import UserError
-from dateutil.relativedelta import relativedelta
 from datetime import datetime, date, timedelta
 import logging
 
@@ -191,6 +190,7 @@ class ConsolidatedPRLine(models.Model):
     @api.depends('product_id', 'warehouse_id', 'quantity', 'purchase_request_line_ids.product_qty')
     def _compute_inventory_data(self):
         """Compute current inventory levels and related data"""
+        lines_by_warehouse = {}
         for line in self:
             # Initialize all computed fields to 0 or False
             line.onhand_qty = 0.0
@@ -209,74 +209,39 @@ class ConsolidatedPRLine(models.Model):
             if line.product_id.type not in ['product', 'consu']:
                 continue
 
-            # Get current stock level with proper location context
-            if line.warehouse_id and line.warehouse_id.lot_stock_id:
-                stock_location = line.warehouse_id.lot_stock_id
-                current_stock = line.product_id.with_context(
-                    location=stock_location.id
-                ).qty_available
-                
-                line.onhand_qty = current_stock
-                
-                # Get forecasted stock
-                stock_quant = self.env['stock.quant'].search([
-                    ('product_id', '=', line.product_id.id),
-                    ('location_id', '=', stock_location.id)
-                ])
-                
-                if stock_quant:
-                    for quant in stock_quant:
-                        quant._compute_forecasted_qty()
-                    line.forecasted_stock = sum(stock_quant.mapped('forecasted_qty'))
-                
+            if line.warehouse_id.lot_stock_id:
+                lines_by_warehouse.setdefault(line.warehouse_id, []).append(line)
+
+        # Fetch the inventory figures once per warehouse for all its lines
+        for warehouse, lines in lines_by_warehouse.items():
+            products = self.env['product.product'].browse({line.product_id.id for line in lines})
+            snapshot = self.env['scm.inventory.snapshot'].get_snapshot(products, warehouse)
+            rules = self.env['scm.inventory.rule'].get_applicable_rules(products, warehouse)
+
+            for line in lines:
+                data = snapshot[line.product_id.id]
+                line.onhand_qty = data['onhand_qty']
+                line.forecasted_stock = data['forecasted_qty']
+                line.expected_receipt_date = data['expected_receipt_date']
+
                 # Get inventory rule data
-                rule = self.env['scm.inventory.rule'].get_applicable_rule(line.product_id, line.warehouse_id)
-                
+                rule = rules[line.product_id.id]
+
                 if rule:
                     line.safety_stock_level = rule.safety_stock_qty
                     line.reorder_point = rule.reorder_point
-                    line.lead_time = rule.lead_time_days
-                    
+                    line.lead_time = rule.lead_time
+
                     # Calculate days of stock if avg daily usage is available
-                    if rule.average_monthly_usage > 0:
-                        line.days_of_stock = line.onhand_qty / (rule.average_monthly_usage / 30)
-                
+                    if rule.avg_daily_usage > 0:
+                        line.days_of_stock = line.onhand_qty / rule.avg_daily_usage
+
                 # Calculate turnover rate using last 90 days data
-                date_from = fields.Date.today() - relativedelta(days=90)
-                moves = self.env['stock.move'].search([
-                    ('product_id', '=', line.product_id.id),
-                    ('location_dest_id.usage', 'in', ['customer', 'production']),
-                    ('location_id.warehouse_id', '=', line.warehouse_id.id),
-                    ('state', '=', 'done'),
-                    ('date', '>=', date_from)
-                ])
-                
-                if moves and line.onhand_qty > 0:
-                    total_qty = sum(move.product_uom_qty for move in moves)
-                    annual_estimate = total_qty * (365 / 90)
+                consumed_qty = data['consumed_qty']
+                line.avg_monthly_consumption = consumed_qty / 3
+                if consumed_qty and line.onhand_qty > 0:
+                    annual_estimate = consumed_qty * (365 / 90)
                     line.turnover_rate = annual_estimate / line.onhand_qty
-                
-                # Expected receipt date - get first scheduled incoming shipment
-                incoming_domain = [
-                    ('product_id', '=', line.product_id.id),
-                    ('location_dest_id.warehouse_id', '=', line.warehouse_id.id),
-                    ('location_dest_id.usage', '=', 'internal'),
-                    ('state', 'in', ['assigned', 'partially_available']),
-                    ('date', '>=', fields.Datetime.now())
-                ]
-                
-                incoming_move = self.env['stock.move'].search(incoming_domain, order='date', limit=1)
-                line.expected_receipt_date = incoming_move.date.date() if incoming_move else False
-            else:
-                # Not a stockable product or no warehouse defined
-                line.onhand_qty = 0.0
-                line.forecasted_stock = 0.0
-                line.safety_stock_level = 0.0
-                line.reorder_point = 0.0
-                line.days_of_stock = 0.0
-                line.lead_time = 0
-                line.turnover_rate = 0.0
-                line.expected_receipt_date = False
 
     @api.depends('product_id', 'warehouse_id')
     def _compute_available_quantity(self):
@@ -322,24 +287,33 @@ class ConsolidatedPRLine(models.Model):
                 else:
                     line.inventory_status = 'insufficient'
 
-    @api.depends('product_id', 'company_id')
+    @api.depends('product_id', 'company_id', 'quantity_to_purchase', 'earliest_date_required', 'suggested_vendor_id')
     def _compute_purchase_price(self):
+        # Load the vendor prices of all the products once per company
+        lines_by_company = {}
         for line in self:
-            if line.product_id:
-                # Get the product supplierinfo with the lowest price
-                supplierinfo = self.env['product.supplierinfo'].search([
-                    '|', 
-                    ('product_id', '=', line.product_id.id),
-                    ('product_tmpl_id', '=', line.product_id.product_tmpl_id.id),
-                    ('company_id', 'in', [line.company_id.id, False])
-                ], limit=1, order='price')
-                
-                if supplierinfo:
-                    line.purchase_price = supplierinfo.price
-                else:
-                    line.purchase_price = line.product_id.standard_price
-            else:
-                line.purchase_price = 0.0
+            lines_by_company.setdefault(line.company_id, []).append(line)
+
+        PriceMatrix = self.env['scm.price.matrix']
+        for company, lines in lines_by_company.items():
+            products = self.env['product.product'].browse({line.product_id.id for line in lines})
+            matrix = PriceMatrix.get_matrix(products, company or None)
+            for line in lines:
+                if not line.product_id:
+                    line.purchase_price = 0.0
+                    continue
+                # Get the lowest price for the quantity and date, from the suggested vendor if any
+                entry = None
+                if line.suggested_vendor_id:
+                    entry = PriceMatrix.best_price(
+                        matrix, line.product_id, line.quantity_to_purchase,
+                        line.earliest_date_required, line.suggested_vendor_id
+                    )
+                if not entry:
+                    entry = PriceMatrix.best_price(
+                        matrix, line.product_id, line.quantity_to_purchase, line.earliest_date_required
+                    )
+                line.purchase_price = entry['price'] if entry else line.product_id.standard_price
 
     @api.depends('quantity_to_purchase', 'purchase_price')
     def _compute_subtotal(self):
@@ -503,21 +477,19 @@ class ConsolidatedPRLine(models.Model):
         return action
 
     def action_suggest_vendors(self):
-        self.ensure_one()
-        
-        if self.suggested_vendor_id:
-            return True
-            
-        # Find vendors who supply this product
-        supplierinfo = self.env['product.supplierinfo'].search([
-            '|',
-            ('product_id', '=', self.product_id.id),
-            ('product_tmpl_id', '=', self.product_id.product_tmpl_id.id),
-            ('company_id', 'in', [self.company_id.id, False])
-        ], order='price')
-        
-        if supplierinfo:
-            self.suggested_vendor_id = supplierinfo[0].partner_id.id
+        lines = self.filtered(lambda l: not l.suggested_vendor_id and l.product_id)
+        
+        # Find vendors who supply these products, cheapest first
+        lines_by_company = {}
+        for line in lines:
+            lines_by_company.setdefault(line.company_id, []).append(line)
+        for company, company_lines in lines_by_company.items():
+            products = self.env['product.product'].browse({line.product_id.id for line in company_lines})
+            vendors = self.env['scm.vendor.index'].get_vendors(products, sources=('supplierinfo',), company=company)
+            for line in company_lines:
+                vendor = vendors[line.product_id.id]
+                if vendor:
+                    line.suggested_vendor_id = vendor.id
         
         return True
 
@@ -562,6 +534,18 @@ class ConsolidatedPRLine(models.Model):
         ('wait', 'Wait for Receipt'),
         ('none', 'No Action')
     ], string='Recommendation', compute='_compute_procurement_recommendation', store=True)
+    transfer_warehouse_id = fields.Many2one(
+        'stock.warehouse',
+        string='Transfer From',
+        compute='_compute_transfer_source',
+        help="Other warehouse with the most available quantity of the product"
+    )
+    transferable_qty = fields.Float(
+        string='Transferable Quantity',
+        digits='Product Unit of Measure',
+        compute='_compute_transfer_source',
+        help="Quantity that could be transferred from the other warehouse, up to the quantity to purchase"
+    )
 
     # Add missing inventory-related fields
     warehouse_id = fields.Many2one(
@@ -586,13 +570,23 @@ class ConsolidatedPRLine(models.Model):
     @api.depends('quantity', 'onhand_qty', 'days_of_stock', 'lead_time')
     def _compute_stock_coverage(self):
         """Calculate stock coverage based on consolidation quantity"""
+        product_ids_by_group = {}
+        for line in self:
+            product_ids_by_group.setdefault((line.warehouse_id, line.company_id), set()).update(line.product_id.ids)
+        rules_by_group = {
+            (warehouse, company): self.env['scm.inventory.rule'].get_applicable_rules(
+                self.env['product.product'].browse(product_ids), warehouse, company=company or None
+            )
+            for (warehouse, company), product_ids in product_ids_by_group.items()
+        }
+
         for line in self:
             if line.product_id.type not in ['product', 'consu']:
                 line.stock_coverage = 0.0
                 continue
                 
             # Get average daily usage from rule
-            rule = self.env['scm.inventory.rule'].get_applicable_rule(line.product_id, line.warehouse_id)
+            rule = rules_by_group[(line.warehouse_id, line.company_id)].get(line.product_id.id)
             
             if rule and rule.avg_daily_usage > 0:
                 # Calculate how many days the current stock will last against the requested quantity
@@ -617,6 +611,7 @@ class ConsolidatedPRLine(models.Model):
     @api.depends('inventory_status', 'expected_receipt_date', 'lead_time', 'onhand_qty', 'quantity')
     def _compute_procurement_recommendation(self):
         """Determine procurement recommendation based on inventory status"""
+        availability = self._get_availability_matrix()
         for line in self:
             if line.product_id.type not in ['product', 'consu']:
                 line.procurement_recommendation = 'none'
@@ -637,21 +632,8 @@ class ConsolidatedPRLine(models.Model):
                     line.procurement_recommendation = 'wait'
                 else:
                     # Check if we have stock in other warehouses for transfer
-                    other_warehouses = self.env['stock.warehouse'].search([
-                        ('id', '!=', line.warehouse_id.id),
-                        ('company_id', '=', line.company_id.id)
-                    ])
-                    
-                    has_stock_elsewhere = False
-                    if other_warehouses:
-                        quants = self.env['stock.quant'].search([
-                            ('product_id', '=', line.product_id.id),
-                            ('location_id.warehouse_id', 'in', other_warehouses.ids),
-                            ('location_id.usage', '=', 'internal'),
-                            ('quantity', '>', line.safety_stock_level)
-                        ])
-                        
-                        has_stock_elsewhere = bool(quants)
+                    warehouse, transferable_qty = line._get_transfer_source(availability)
+                    has_stock_elsewhere = bool(warehouse) and transferable_qty > line.safety_stock_level
                     
                     if has_stock_elsewhere:
                         line.procurement_recommendation = 'transfer'
@@ -669,6 +651,41 @@ class ConsolidatedPRLine(models.Model):
                 # Normal or excess stock
                 line.procurement_recommendation = 'none'
     
+    def _get_availability_matrix(self):
+        """Available quantity per product and warehouse for the lines, with
+        one grouped query per company"""
+        product_ids_by_company = {}
+        for line in self:
+            product_ids_by_company.setdefault(line.company_id, set()).add(line.product_id.id)
+        availability = {}
+        for company, product_ids in product_ids_by_company.items():
+            availability[company.id] = self.env['scm.inventory.snapshot'].get_availability_matrix(
+                self.env['product.product'].browse(product_ids), company or None
+            )
+        return availability
+
+    def _get_transfer_source(self, availability):
+        """Return the other warehouse with the most available quantity of the
+        product and that quantity, or (False, 0.0)"""
+        self.ensure_one()
+        by_warehouse = availability.get(self.company_id.id, {}).get(self.product_id.id, {})
+        candidates = [
+            (quantity, warehouse_id) for warehouse_id, quantity in by_warehouse.items()
+            if warehouse_id != self.warehouse_id.id and quantity > 0
+        ]
+        if not candidates:
+            return self.env['stock.warehouse'], 0.0
+        quantity, warehouse_id = max(candidates)
+        return self.env['stock.warehouse'].browse(warehouse_id), quantity
+
+    @api.depends('product_id', 'warehouse_id', 'company_id', 'quantity_to_purchase')
+    def _compute_transfer_source(self):
+        availability = self._get_availability_matrix()
+        for line in self:
+            warehouse, quantity = line._get_transfer_source(availability)
+            line.transfer_warehouse_id = warehouse
+            line.transferable_qty = min(quantity, line.quantity_to_purchase) if warehouse else 0.0
+
     def action_view_product_stock(self):
         """Open stock quants for this product"""
         self.ensure_one()
@@ -829,6 +846,12 @@ class ConsolidatedPRLine(models.Model):
     @api.depends('product_id', 'warehouse_id')
     def _compute_procurement_history(self):
         """Compute procurement history metrics"""
+        # Last purchase and usage over the last three months, for all the lines at once
+        lines = self.filtered(lambda l: l.product_id and l.warehouse_id)
+        history = self.env['scm.inventory.snapshot'].get_procurement_history(
+            lines.mapped('product_id'), lines.mapped('warehouse_id'), usage_days=90
+        )
+
         for line in self:
             if not line.product_id or not line.warehouse_id:
                 line.last_purchase_date = False
@@ -837,38 +860,10 @@ class ConsolidatedPRLine(models.Model):
                 line.turnover_rate = 0.0
                 continue
 
-            # Get last purchase with fixed ordering
-            domain = [
-                ('product_id', '=', line.product_id.id),
-                ('state', '=', 'purchase'),
-                ('order_id.picking_type_id.warehouse_id', '=', line.warehouse_id.id)
-            ]
-            last_po_line = self.env['purchase.order.line'].search(
-                domain, 
-                order='create_date desc',  # Changed from order_id.date_order
-                limit=1
-            )
-            
-            # Get date from order if exists
-            if last_po_line and last_po_line.order_id:
-                line.last_purchase_date = last_po_line.order_id.date_order.date() if last_po_line.order_id.date_order else False
-                line.last_purchase_price = last_po_line.price_unit
-            else:
-                line.last_purchase_date = False
-                line.last_purchase_price = 0.0
-
-            # Calculate average monthly usage using relativedelta
-            three_months_ago = fields.Date.today() - relativedelta(months=3)
-            usage_moves = self.env['stock.move'].search([
-                ('product_id', '=', line.product_id.id),
-                ('location_id.warehouse_id', '=', line.warehouse_id.id),
-                ('location_dest_id.usage', 'in', ['customer', 'production']),
-                ('state', '=', 'done'),
-                ('date', '>=', three_months_ago)
-            ])
-            
-            total_usage = sum(usage_moves.mapped('product_uom_qty'))
-            line.avg_monthly_usage = total_usage / 3 if total_usage else 0.0
+            values = history[line.product_id.id, line.warehouse_id.id]
+            line.last_purchase_date = values['last_purchase_date']
+            line.last_purchase_price = values['last_purchase_price']
+            line.avg_monthly_usage = values['monthly_usage']
 
             # Calculate turnover rate
             if line.avg_monthly_usage and line.onhand_qty:
@@ -930,26 +925,37 @@ class ConsolidatedPRLine(models.Model):
             
         return res
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        lines = super(ConsolidatedPRLine, self).create(vals_list)
+        lines.mapped('purchase_request_line_ids')._update_fulfillment_status()
+        return lines
+
+    def write(self, vals):
+        if 'purchase_request_line_ids' in vals:
+            # Lines unlinked from the consolidated lines change status too
+            pr_lines = self.mapped('purchase_request_line_ids')
+        res = super(ConsolidatedPRLine, self).write(vals)
+        # With scm_defer_fulfillment, the caller updates the fulfillment once for all its lines
+        if self.env.context.get('scm_defer_fulfillment'):
+            return res
+        if 'purchase_request_line_ids' in vals:
+            (pr_lines | self.mapped('purchase_request_line_ids'))._update_fulfillment_status()
+        elif 'state' in vals:
+            self.mapped('purchase_request_line_ids')._update_fulfillment_status()
+        return res
+
     def unlink(self):
         """Override unlink to clean up purchase requests when a consolidated line is removed."""
         # Store consolidation_id before deletion
         consolidation_ids = self.mapped('consolidation_id')
+        pr_lines = self.mapped('purchase_request_line_ids')
         
         # Call the parent unlink method to perform the actual deletion
         result = super(ConsolidatedPRLine, self).unlink()
+        pr_lines._update_fulfillment_status()
         
-        # After deletion, check each consolidation session
-        for consolidation in consolidation_ids:
-            # Get all purchase request IDs from remaining lines
-            remaining_pr_ids = consolidation.consolidated_line_ids.mapped('purchase_request_line_ids.request_id').ids
-            
-            # Update the consolidation session to only include purchase requests with remaining lines
-            consolidation.write({
-                'purchase_request_ids': [(6, 0, remaining_pr_ids)]
-            })
-            
-            # If no lines remain, reset the state to draft
-            if not consolidation.consolidated_line_ids:
-                consolidation.write({'state': 'draft'})
+        # After deletion, unlink the purchase requests left without lines
+        consolidation_ids.exists()._sync_purchase_requests()
         
         return result
\ No newline at end of file
@@ -2,6 +2,7 @@
 
 from odoo import models, fields, api, _
 from odoo.exceptions import UserError, ValidationError
+from contextlib import contextmanager
 from datetime import datetime
 import logging
 
@@ -87,11 +88,12 @@ class PRConsolidationSession(models.Model):
     #)
     po_count = fields.Integer(
         string='Purchase Orders',
-        compute='_compute_po_count'
+        compute='_compute_po_count',
+        store=True
     )
     total_amount = fields.Float(
         string='Total Amount',
-        compute='_compute_total_amount',
+        compute='_compute_kpis',
         store=True
     )
     creation_date = fields.Datetime(
@@ -115,7 +117,8 @@ class PRConsolidationSession(models.Model):
     )
     pr_count = fields.Integer(
         string='Purchase Requests',
-        compute='_compute_pr_count'
+        compute='_compute_pr_count',
+        store=True
     )
     currency_id = fields.Many2one(
         'res.currency',
@@ -130,6 +133,30 @@ class PRConsolidationSession(models.Model):
         default=lambda self: self.env['stock.warehouse'].search([], limit=1),
         tracking=True
     )
+    perf_trace_ids = fields.One2many(
+        'scm.perf.trace',
+        'session_id',
+        string='Performance Traces',
+        readonly=True
+    )
+    job_ids = fields.One2many(
+        'scm.consolidation.job',
+        'session_id',
+        string='Background Jobs'
+    )
+    active_job_id = fields.Many2one(
+        'scm.consolidation.job',
+        string='Running Job',
+        compute='_compute_active_job'
+    )
+    job_progress = fields.Float(
+        string='Job Progress',
+        related='active_job_id.progress'
+    )
+    job_date_eta = fields.Datetime(
+        string='Estimated Completion',
+        related='active_job_id.date_eta'
+    )
 
     @api.model_create_multi
     def create(self, vals_list):
@@ -144,23 +171,58 @@ class PRConsolidationSession(models.Model):
             if session.date_from > session.date_to:
                 raise ValidationError(_("End date cannot be earlier than start date."))
 
-    @api.depends('consolidated_line_ids.subtotal')
-    def _compute_total_amount(self):
+    @api.depends('purchase_order_ids')
+    def _compute_po_count(self):
+        # Stored counters do not depend on the access rights of the user
+        po_counts = dict(self.env['purchase.order'].sudo()._read_group(
+            [('consolidation_id', 'in', self.ids)],
+            groupby=['consolidation_id'],
+            aggregates=['__count'],
+        ))
         for session in self:
-            session.total_amount = sum(session.consolidated_line_ids.mapped('subtotal'))
+            session.po_count = po_counts.get(session._origin, 0)
 
-    def _compute_po_count(self):
+    @api.depends('job_ids.state')
+    def _compute_active_job(self):
         for session in self:
-            session.po_count = self.env['purchase.order'].search_count([
-                ('consolidation_id', '=', session.id)
-            ])
+            session.active_job_id = session.job_ids.filtered(
+                lambda j: j.state in ['pending', 'running']
+            )[:1]
 
+    @api.model
+    def _get_async_threshold(self):
+        """Number of lines above which a session is processed in background"""
+        return int(self.env['ir.config_parameter'].sudo().get_param('scm_procurement.async_line_threshold', 1000))
+
+    def _enqueue_job(self, job_type, pr_lines=None):
+        """Run a bulk operation of the session in background and notify the user"""
+        self.ensure_one()
+        if self.active_job_id:
+            raise UserError(_('A background job is already running for this session.'))
+        job = self.env['scm.consolidation.job']._enqueue(self, job_type, pr_lines=pr_lines)
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('Processing in Background'),
+                'message': _("%s products will be processed in background. "
+                             "The progress is shown on the session.") % job.total_count,
+                'sticky': False,
+                'type': 'info',
+                'next': {'type': 'ir.actions.act_window_close'},
+            }
+        }
+
+    @api.depends('purchase_request_ids')
     def _compute_pr_count(self):
+        # Group the purchase requests by session through the relation table
+        pr_counts = dict(self.env['purchase.request'].sudo()._read_group(
+            [('consolidation_ids', 'in', self.ids)],
+            groupby=['consolidation_ids'],
+            aggregates=['__count'],
+        ))
         for session in self:
-            purchase_requests = self.env['purchase.request'].search([
-                ('consolidation_ids', 'in', session.id)
-            ])
-            session.pr_count = len(purchase_requests)
+            session.pr_count = pr_counts.get(session._origin, 0)
 
     def action_start_consolidation(self):
         """Start the consolidation process."""
@@ -216,106 +278,137 @@ class PRConsolidationSession(models.Model):
         
         if safe_self is None:
             safe_self = self.with_context(tracking_disable=True, mail_notrack=True)
-        
-        # Dictionary to group PR lines by product
-        product_lines = {}
-        
-        # Process each line
-        for line in pr_lines:
-            _logger.info("Processing line: %s", line)
-            if not line.product_id:
-                continue
-                
-            product_id = line.product_id.id
-            
-            # Group by product
-            if product_id not in product_lines:
-                product_lines[product_id] = {
-                    'product': line.product_id,
-                    'uom': line.product_uom_id,
-                    'total_qty': 0,
-                    'pr_lines': [],
-                    'earliest_date': line.date_required or line.request_id.date_start,
-                }
-            
-            # Update group data
-            data = product_lines[product_id]
-            data['total_qty'] += line.product_qty
-            data['pr_lines'].append(line)
-            
-            # Update earliest date needed
-            line_date = line.date_required or line.request_id.date_start
-            if line_date and (not data['earliest_date'] or line_date < data['earliest_date']):
-                data['earliest_date'] = line_date
-        
-        _logger.info("Product lines grouped: %s", product_lines)
-        
-        # Process each product group to create/update consolidated lines
-        created_lines = []
-        for product_id, data in product_lines.items():
-            try:
-                _logger.info("Creating/updating consolidated line for product: %s", product_id)
-                ConsolidatedLine = self.env['scm.consolidated.pr.line'].with_context(
-                    tracking_disable=True, 
-                    mail_notrack=True
-                )
-                
-                # Check if a consolidated line already exists for this product
-                existing_line = safe_self.consolidated_line_ids.filtered(
-                    lambda l: l.product_id.id == product_id
-                )
-                
-                # Convert pr_lines list to recordset
-                pr_line_ids = [(6, 0, [line.id for line in data['pr_lines']])]
-                
-                if existing_line:
-                    _logger.info("Updating existing line: %s", existing_line)
-                    # Update existing line
-                    existing_line.write({
-                        'total_quantity': data['total_qty'],
-                        'purchase_request_line_ids': pr_line_ids,
-                        'earliest_date_required': data['earliest_date'],
-                    })
-                    created_lines.append(existing_line)
-                else:
-                    _logger.info("Creating new consolidated line for product: %s", product_id)
-                    # Create new consolidated line
-                    new_line = ConsolidatedLine.create({
-                        'consolidation_id': safe_self.id,
-                        'product_id': product_id,
-                        'product_uom_id': data['uom'].id,
-                        'total_quantity': data['total_qty'],
-                        'purchase_request_line_ids': pr_line_ids,
-                        'earliest_date_required': data['earliest_date'],
-                        'state': 'draft'
-                    })
-                    _logger.info("Created new consolidated line: %s", new_line)
-                    created_lines.append(new_line)
-            except Exception as line_err:
-                _logger.error("Error processing product %s: %s", product_id, str(line_err))
-                # Continue to next product
-        
-        # Refresh the record to get the updated consolidated lines
-        safe_self.invalidate_recordset()
-        
-        # Log the current state of consolidated lines
-        _logger.info("Current consolidated lines before recompute: %s", safe_self.consolidated_line_ids)
-        _logger.info("Created/Updated lines: %s", created_lines)
-        
-        # Force a recompute of the consolidated lines
-        for line in safe_self.consolidated_line_ids:
-            line._compute_available_quantity()
-            line._compute_quantity_to_purchase()
-            line._compute_inventory_status()
-        
-        # Log final state
-        _logger.info("Final consolidated lines after recompute: %s", safe_self.consolidated_line_ids)
-        
+
+        safe_self._consolidate_pr_lines(pr_lines)
+
         # Update the session state to in_progress
         safe_self.write({'state': 'in_progress'})
-        
+
         return True
 
+    def _consolidate_pr_lines(self, pr_lines):
+        """Merge purchase request lines into the consolidated lines of the session.
+
+        Returns the consolidated lines created or updated, with their stock
+        figures recomputed.
+        """
+        self.ensure_one()
+
+        with self.env['scm.perf.trace']._trace(self, 'consolidation') as trace, self._defer_kpis():
+            # Group the PR lines by product in the database
+            product_groups = self._group_pr_lines_by_product(pr_lines)
+            _logger.info("Product lines grouped: %d products", len(product_groups))
+
+            try:
+                with self.env.cr.savepoint():
+                    lines = self._apply_consolidation_groups(product_groups)
+            except Exception as batch_err:
+                _logger.error("Batch consolidation failed, processing products one by one: %s", str(batch_err))
+                lines = self.env['scm.consolidated.pr.line']
+                for product_id, data in product_groups.items():
+                    try:
+                        with self.env.cr.savepoint():
+                            lines |= self._apply_consolidation_groups({product_id: data})
+                    except Exception as line_err:
+                        _logger.error("Error processing product %s: %s", product_id, str(line_err))
+                        # Continue to next product
+
+            # Refresh the record to get the updated consolidated lines
+            self.invalidate_recordset()
+            _logger.info("Created/Updated lines: %s", lines)
+
+            # Force a recompute of the consolidated lines, once for the whole recordset
+            lines._compute_available_quantity()
+            lines._compute_quantity_to_purchase()
+            lines._compute_inventory_status()
+            trace['records'] = len(lines)
+
+        return lines
+
+    def _group_pr_lines_by_product(self, pr_lines):
+        """Aggregate purchase request lines per product with grouped queries.
+
+        Returns a dict keyed by product id with the UoM of the first line of
+        the product, the total quantity, the PR line ids and the earliest
+        required date (the request start date is used for undated lines).
+        """
+        PRLine = self.env['purchase.request.line']
+        domain = [('id', 'in', pr_lines.ids), ('product_id', '!=', False)]
+        position = {line_id: index for index, line_id in enumerate(pr_lines.ids)}
+
+        product_groups = {}
+        for product, uom, total_qty, earliest_date, line_ids in PRLine._read_group(
+            domain,
+            groupby=['product_id', 'product_uom_id'],
+            aggregates=['product_qty:sum', 'date_required:min', 'id:array_agg'],
+        ):
+            data = product_groups.setdefault(product.id, {
+                'uom_id': uom.id,
+                'first_position': len(position),
+                'total_qty': 0.0,
+                'line_ids': [],
+                'earliest_date': False,
+            })
+            # Keep the UoM of the first line, as the line-by-line loop did
+            first_position = min(position[line_id] for line_id in line_ids)
+            if first_position < data['first_position']:
+                data['first_position'] = first_position
+                data['uom_id'] = uom.id
+            data['total_qty'] += total_qty
+            data['line_ids'] += line_ids
+            if earliest_date and (not data['earliest_date'] or earliest_date < data['earliest_date']):
+                data['earliest_date'] = earliest_date
+
+        # Lines without a required date fall back on their request start date
+        for product, request in PRLine._read_group(
+            domain + [('date_required', '=', False)],
+            groupby=['product_id', 'request_id'],
+        ):
+            data = product_groups[product.id]
+            if request.date_start and (not data['earliest_date'] or request.date_start < data['earliest_date']):
+                data['earliest_date'] = request.date_start
+
+        return product_groups
+
+    def _apply_consolidation_groups(self, product_groups):
+        """Create or update the consolidated lines for grouped PR lines.
+
+        New products are created with a single multi-record create and the
+        existing lines are updated through one write on the session.
+        """
+        self.ensure_one()
+        ConsolidatedLine = self.env['scm.consolidated.pr.line'].with_context(
+            tracking_disable=True,
+            mail_notrack=True
+        )
+        existing_by_product = {line.product_id.id: line.id for line in self.consolidated_line_ids}
+
+        create_vals_list = []
+        update_commands = []
+        for product_id, data in product_groups.items():
+            vals = {
+                'total_quantity': data['total_qty'],
+                'purchase_request_line_ids': [(6, 0, data['line_ids'])],
+                'earliest_date_required': data['earliest_date'],
+            }
+            if product_id in existing_by_product:
+                update_commands.append((1, existing_by_product[product_id], vals))
+            else:
+                vals.update({
+                    'consolidation_id': self.id,
+                    'product_id': product_id,
+                    'product_uom_id': data['uom_id'],
+                    'state': 'draft',
+                })
+                create_vals_list.append(vals)
+
+        new_lines = ConsolidatedLine.create(create_vals_list) if create_vals_list else ConsolidatedLine
+        if update_commands:
+            self.write({'consolidated_line_ids': update_commands})
+        _logger.info("Created %d and updated %d consolidated lines", len(new_lines), len(update_commands))
+
+        return new_lines | ConsolidatedLine.browse([command[1] for command in update_commands])
+
     def action_validate_consolidation(self):
         """Validate the consolidated lines."""
         self.ensure_one()
@@ -557,8 +650,8 @@ class PRConsolidationSession(models.Model):
     inventory_validated_by = fields.Many2one('res.users', 'Validated By', readonly=True, copy=False)
     inventory_validation_notes = fields.Text('Validation Notes', copy=False)
     
-    has_inventory_issues = fields.Boolean('Has Inventory Issues', compute='_compute_inventory_status', store=True)
-    has_critical_shortages = fields.Boolean('Has Critical Shortages', compute='_compute_inventory_status', store=True)
+    has_inventory_issues = fields.Boolean('Has Inventory Issues', compute='_compute_kpis', store=True)
+    has_critical_shortages = fields.Boolean('Has Critical Shortages', compute='_compute_kpis', store=True)
     pending_approval = fields.Boolean('Pending Inventory Approval', default=False, copy=False)
     inventory_status = fields.Selection([
         ('not_validated', 'Not Validated'),
@@ -567,9 +660,9 @@ class PRConsolidationSession(models.Model):
         ('rejected', 'Inventory Rejected')
     ], string='Inventory Status', default='not_validated', copy=False)
     
-    total_stockout_items = fields.Integer('Total Stockout Items', compute='_compute_inventory_status', store=True)
-    total_below_safety = fields.Integer('Items Below Safety Stock', compute='_compute_inventory_status', store=True)
-    total_below_reorder = fields.Integer('Items Below Reorder Point', compute='_compute_inventory_status', store=True)
+    total_stockout_items = fields.Integer('Total Stockout Items', compute='_compute_kpis', store=True)
+    total_below_safety = fields.Integer('Items Below Safety Stock', compute='_compute_kpis', store=True)
+    total_below_reorder = fields.Integer('Items Below Reorder Point', compute='_compute_kpis', store=True)
     
     # Extend state selection to include inventory validation steps
     # state = fields.Selection(selection_add=[
@@ -577,28 +670,75 @@ class PRConsolidationSession(models.Model):
     #     ('approved', 'Approved')
     # ])
 
-    @api.depends('consolidated_line_ids.inventory_status')
-    def _compute_inventory_status(self):
-        """Compute inventory status flags"""
+    # Stored session figures aggregated from the consolidated lines
+    _KPI_FIELDS = [
+        'total_amount',
+        'total_stockout_items',
+        'total_below_safety',
+        'total_below_reorder',
+        'has_critical_shortages',
+        'has_inventory_issues',
+    ]
+
+    @api.depends('consolidated_line_ids.subtotal', 'consolidated_line_ids.inventory_status',
+                 'consolidated_line_ids.product_id')
+    def _compute_kpis(self):
+        """Compute the total amount and the inventory status flags"""
+        kpis = {}
+        sessions = self.filtered('id')
+        if sessions:
+            self.env['scm.consolidated.pr.line'].flush_model(
+                ['consolidation_id', 'product_id', 'subtotal', 'inventory_status'])
+            # Only stockable products count in the inventory figures
+            self.env.cr.execute("""
+                SELECT line.consolidation_id,
+                       COALESCE(SUM(line.subtotal), 0),
+                       COUNT(*) FILTER (WHERE line.inventory_status = 'stockout' AND tmpl.type IN ('product', 'consu')),
+                       COUNT(*) FILTER (WHERE line.inventory_status = 'below_safety' AND tmpl.type IN ('product', 'consu')),
+                       COUNT(*) FILTER (WHERE line.inventory_status = 'below_reorder' AND tmpl.type IN ('product', 'consu'))
+                  FROM scm_consolidated_pr_line line
+             LEFT JOIN product_product product ON product.id = line.product_id
+             LEFT JOIN product_template tmpl ON tmpl.id = product.product_tmpl_id
+                 WHERE line.consolidation_id IN %s
+              GROUP BY line.consolidation_id
+            """, [tuple(sessions.ids)])
+            kpis = {row[0]: row[1:] for row in self.env.cr.fetchall()}
+
         for consolidation in self:
-            stockout_items = consolidation.consolidated_line_ids.filtered(
-                lambda l: l.inventory_status == 'stockout' and l.product_id.type in ['product', 'consu']
-            )
+            if consolidation.id:
+                total_amount, stockout, below_safety, below_reorder = kpis.get(consolidation.id, (0.0, 0, 0, 0))
+            else:
+                # New records only exist in memory
+                lines = consolidation.consolidated_line_ids
+                stockable_statuses = [
+                    l.inventory_status for l in lines if l.product_id.type in ['product', 'consu']
+                ]
+                total_amount = sum(lines.mapped('subtotal'))
+                stockout = stockable_statuses.count('stockout')
+                below_safety = stockable_statuses.count('below_safety')
+                below_reorder = stockable_statuses.count('below_reorder')
+
+            consolidation.total_amount = total_amount
+            consolidation.total_stockout_items = stockout
+            consolidation.total_below_safety = below_safety
+            consolidation.total_below_reorder = below_reorder
             
-            below_safety_items = consolidation.consolidated_line_ids.filtered(
-                lambda l: l.inventory_status == 'below_safety' and l.product_id.type in ['product', 'consu'] 
-            )
-            
-            below_reorder_items = consolidation.consolidated_line_ids.filtered(
-                lambda l: l.inventory_status == 'below_reorder' and l.product_id.type in ['product', 'consu']
-            )
-            
-            consolidation.total_stockout_items = len(stockout_items)
-            consolidation.total_below_safety = len(below_safety_items)
-            consolidation.total_below_reorder = len(below_reorder_items)
-            
-            consolidation.has_critical_shortages = bool(stockout_items or below_safety_items)
-            consolidation.has_inventory_issues = bool(stockout_items or below_safety_items or below_reorder_items)
+            consolidation.has_critical_shortages = bool(stockout or below_safety)
+            consolidation.has_inventory_issues = bool(stockout or below_safety or below_reorder)
+
+    def _refresh_kpis(self):
+        """Recompute and store the KPIs of the sessions now"""
+        for fname in self._KPI_FIELDS:
+            self.env.add_to_compute(self._fields[fname], self)
+        self.flush_recordset(self._KPI_FIELDS)
+
+    @contextmanager
+    def _defer_kpis(self):
+        """Bulk operation on the lines of the sessions: their KPIs are
+        recomputed once at the end instead of after every line change"""
+        with self.env.protecting([self._fields[fname] for fname in self._KPI_FIELDS], self):
+            yield
+        self._refresh_kpis()
     
     def action_forecast_inventory(self):
         """Open wizard to forecast inventory for selected products"""
@@ -631,13 +771,11 @@ class PRConsolidationSession(models.Model):
         if not self.consolidated_line_ids:
             raise UserError(_("No consolidated lines to check."))
         
-        # Update inventory status for all lines
-        for line in self.consolidated_line_ids:
-            if line.product_id.type in ['product', 'consu']:
-                line._compute_inventory_status()
-        
-        # Update overall status
-        self._compute_inventory_status()
+        if len(self.consolidated_line_ids) > self._get_async_threshold():
+            return self._enqueue_job('check_inventory')
+
+        # Update inventory status for all lines, and the overall status once
+        self._check_inventory_lines(self.consolidated_line_ids)
         
         # Show notification with results
         return {
@@ -660,6 +798,14 @@ class PRConsolidationSession(models.Model):
             }
         }
     
+    def _check_inventory_lines(self, lines):
+        """Recompute the inventory status of the stockable lines"""
+        self.ensure_one()
+        with self.env['scm.perf.trace']._trace(self, 'inventory_check') as trace, self._defer_kpis():
+            lines = lines.filtered(lambda l: l.product_id.type in ['product', 'consu'])
+            lines._compute_inventory_status()
+            trace['records'] = len(lines)
+    
     def action_view_inventory_issues(self):
         """View consolidated lines with inventory issues"""
         self.ensure_one()
@@ -761,15 +907,48 @@ class PRConsolidationSession(models.Model):
     def _onchange_consolidated_line_ids(self):
         """Update purchase requests when consolidated lines change."""
         if self.consolidated_line_ids:
-            # Get all purchase request IDs from the current lines
-            pr_ids = self.consolidated_line_ids.mapped('purchase_request_line_ids.request_id').ids
-            
-            # Update the purchase_request_ids field
-            self.purchase_request_ids = [(6, 0, pr_ids)]
-            
+            # Link or unlink only the requests whose lines were added or removed
+            line_request_ids = set(self.consolidated_line_ids.mapped('purchase_request_line_ids.request_id')._origin.ids)
+            linked_ids = set(self.purchase_request_ids._origin.ids)
+            commands = [(4, request_id) for request_id in line_request_ids - linked_ids]
+            commands += [(3, request_id) for request_id in linked_ids - line_request_ids]
+            if commands:
+                self.purchase_request_ids = commands
+
+    def _sync_purchase_requests(self):
+        """Link the sessions to the requests of their consolidated lines and
+        unlink the requests left without lines, as a delta of the relation"""
+        if not self.ids:
+            return
+        self.env['scm.consolidated.pr.line'].flush_model(['consolidation_id', 'purchase_request_line_ids'])
+        self.env['purchase.request.line'].flush_model(['request_id'])
+        relation = self.env['scm.consolidated.pr.line']._fields['purchase_request_line_ids']
+        # Requests of the remaining lines of each session, in one aggregate query
+        self.env.cr.execute("""
+            SELECT line.consolidation_id,
+                   array_agg(DISTINCT pr_line.request_id) FILTER (WHERE pr_line.request_id IS NOT NULL)
+              FROM scm_consolidated_pr_line line
+         LEFT JOIN {relation} rel ON rel.{column1} = line.id
+         LEFT JOIN purchase_request_line pr_line ON pr_line.id = rel.{column2}
+             WHERE line.consolidation_id IN %s
+          GROUP BY line.consolidation_id
+        """.format(relation=relation.relation, column1=relation.column1, column2=relation.column2),
+            [tuple(self.ids)])
+        request_ids = dict(self.env.cr.fetchall())
+
+        for session in self:
+            vals = {}
+            line_request_ids = set(request_ids.get(session.id) or [])
+            linked_ids = set(session.purchase_request_ids.ids)
+            commands = [(4, request_id) for request_id in line_request_ids - linked_ids]
+            commands += [(3, request_id) for request_id in linked_ids - line_request_ids]
+            if commands:
+                vals['purchase_request_ids'] = commands
             # If no lines remain, reset the state to draft
-            if not self.consolidated_line_ids:
-                self.state = 'draft'
+            if session.id not in request_ids and session.state != 'draft':
+                vals['state'] = 'draft'
+            if vals:
+                super(PRConsolidationSession, session).write(vals)
 
     def write(self, vals):
         """Override write to handle consolidated line removal."""
@@ -777,15 +956,7 @@ class PRConsolidationSession(models.Model):
         
         # Check if consolidated_line_ids was modified
         if 'consolidated_line_ids' in vals:
-            # Get all purchase request IDs from the current lines
-            pr_ids = self.consolidated_line_ids.mapped('purchase_request_line_ids.request_id').ids
-            
-            # Update the purchase_request_ids field
-            self.write({'purchase_request_ids': [(6, 0, pr_ids)]})
-            
-            # If no lines remain, reset the state to draft
-            if not self.consolidated_line_ids:
-                self.write({'state': 'draft'})
+            self._sync_purchase_requests()
         
         return result
 
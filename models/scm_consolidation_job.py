@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, api, _
+from odoo.tools import config, split_every
+from datetime import timedelta
+import logging
+import threading
+import time
+
+_logger = logging.getLogger(__name__)
+
+
+class ScmConsolidationJob(models.Model):
+    _name = 'scm.consolidation.job'
+    _description = 'Consolidation Background Job'
+    _order = 'id'
+
+    session_id = fields.Many2one(
+        'scm.pr.consolidation.session',
+        string='Consolidation Session',
+        required=True,
+        ondelete='cascade',
+        index=True
+    )
+    job_type = fields.Selection([
+        ('consolidate', 'Consolidate Lines'),
+        ('check_inventory', 'Check Inventory'),
+    ], string='Job Type', required=True)
+    state = fields.Selection([
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ], string='Status', default='pending', required=True, index=True)
+    user_id = fields.Many2one(
+        'res.users',
+        string='Requested By',
+        default=lambda self: self.env.user
+    )
+    pr_line_ids = fields.Many2many(
+        'purchase.request.line',
+        relation='scm_consolidation_job_pr_line_rel',
+        column1='job_id',
+        column2='line_id',
+        string='Purchase Request Lines'
+    )
+    pending_product_ids = fields.Many2many(
+        'product.product',
+        relation='scm_consolidation_job_product_rel',
+        column1='job_id',
+        column2='product_id',
+        string='Products To Process'
+    )
+    total_count = fields.Integer(string='Products', readonly=True)
+    done_count = fields.Integer(string='Processed Products', readonly=True)
+    progress = fields.Float(string='Progress', compute='_compute_progress')
+    date_started = fields.Datetime(string='Started On', readonly=True)
+    date_finished = fields.Datetime(string='Finished On', readonly=True)
+    date_eta = fields.Datetime(string='Estimated Completion', compute='_compute_progress')
+    error_message = fields.Text(string='Error', readonly=True)
+
+    @api.depends('total_count', 'done_count', 'date_started', 'state')
+    def _compute_progress(self):
+        now = fields.Datetime.now()
+        for job in self:
+            job.progress = 100.0 * job.done_count / job.total_count if job.total_count else 0.0
+            job.date_eta = False
+            if job.state == 'running' and job.date_started and job.done_count:
+                # Extrapolate from the average time spent on the processed products
+                elapsed = (now - job.date_started).total_seconds()
+                remaining = job.total_count - job.done_count
+                job.date_eta = now + timedelta(seconds=elapsed / job.done_count * remaining)
+
+    @api.model
+    def _get_chunk_size(self):
+        """Number of products processed (and committed) at once"""
+        return int(self.env['ir.config_parameter'].sudo().get_param('scm_procurement.job_chunk_size', 200))
+
+    @api.model
+    def _get_time_limit(self):
+        """Seconds a cron run may spend on jobs, within the real time limit
+        of the cron workers minus a margin to commit the last chunk"""
+        limit = config['limit_time_real_cron']
+        if limit is None or limit < 0:
+            limit = config['limit_time_real']
+        if not limit:
+            # No limit configured on the workers
+            return 600
+        return max(limit - 30, limit / 2)
+
+    @api.model
+    def _enqueue(self, session, job_type, pr_lines=None):
+        """Create a job for a session and wake up the cron that runs it"""
+        if job_type == 'consolidate':
+            products = pr_lines.mapped('product_id')
+        else:
+            products = session.consolidated_line_ids.mapped('product_id')
+        job = self.create({
+            'session_id': session.id,
+            'job_type': job_type,
+            'pr_line_ids': [(6, 0, pr_lines.ids)] if pr_lines else False,
+            'pending_product_ids': [(6, 0, products.ids)],
+            'total_count': len(products),
+        })
+        cron = self.env.ref('scm_procurement.ir_cron_scm_consolidation_jobs', raise_if_not_found=False)
+        if cron:
+            cron._trigger()
+        return job
+
+    @api.model
+    def _cron_process_jobs(self, time_limit=None):
+        """Run the pending jobs chunk by chunk.
+
+        Every chunk is committed, so a job interrupted by a crash or by the
+        time limit resumes from the products left on the next run.
+        """
+        auto_commit = not getattr(threading.current_thread(), 'testing', False)
+        deadline = time.time() + (time_limit or self._get_time_limit())
+        jobs = self.search([('state', 'in', ['pending', 'running'])])
+        for job in jobs:
+            if not job._run(deadline, auto_commit):
+                # Out of time: reschedule to continue with the remaining products
+                cron = self.env.ref('scm_procurement.ir_cron_scm_consolidation_jobs', raise_if_not_found=False)
+                if cron:
+                    cron._trigger()
+                break
+        return True
+
+    def _run(self, deadline, auto_commit=True):
+        """Process the remaining products of the job. Returns False if the
+        deadline is reached before the job is finished."""
+        self.ensure_one()
+        if self.state == 'pending':
+            self.write({'state': 'running', 'date_started': fields.Datetime.now()})
+            if auto_commit:
+                self.env.cr.commit()
+
+        for product_ids in split_every(self._get_chunk_size(), self.pending_product_ids.ids):
+            if time.time() > deadline:
+                return False
+            products = self.env['product.product'].browse(product_ids)
+            try:
+                self._process_chunk(products)
+                self.write({
+                    'pending_product_ids': [(3, product_id) for product_id in product_ids],
+                    'done_count': self.done_count + len(product_ids),
+                })
+                if auto_commit:
+                    self.env.cr.commit()
+            except Exception as err:
+                _logger.exception("Consolidation job %s failed", self.id)
+                if auto_commit:
+                    self.env.cr.rollback()
+                self.write({
+                    'state': 'failed',
+                    'date_finished': fields.Datetime.now(),
+                    'error_message': str(err),
+                })
+                self.session_id.message_post(body=_("Background job failed: %s") % str(err))
+                if auto_commit:
+                    self.env.cr.commit()
+                return True
+
+        self._finalize()
+        self.write({'state': 'done', 'date_finished': fields.Datetime.now()})
+        if auto_commit:
+            self.env.cr.commit()
+        return True
+
+    def _get_session(self):
+        """Session of the job, with the access rights of the requesting user"""
+        session = self.session_id
+        if self.user_id:
+            session = session.with_user(self.user_id)
+        return session
+
+    def _process_chunk(self, products):
+        """Process the lines of a set of products"""
+        session = self._get_session().with_context(tracking_disable=True, mail_notrack=True)
+        product_ids = set(products.ids)
+        if self.job_type == 'consolidate':
+            pr_lines = self.pr_line_ids.filtered(lambda l: l.product_id.id in product_ids).with_env(session.env)
+            session._consolidate_pr_lines(pr_lines)
+        else:
+            lines = session.consolidated_line_ids.filtered(lambda l: l.product_id.id in product_ids)
+            session._check_inventory_lines(lines)
+
+    def _finalize(self):
+        """Update the session once all the products are processed"""
+        session = self._get_session()
+        if self.job_type == 'consolidate':
+            session.write({'state': 'in_progress'})
+            # Link the requests of the new lines without dropping earlier ones
+            session._sync_purchase_requests()
+            session.message_post(body=_("Consolidation of %s products completed.") % self.total_count)
+        else:
+            session._refresh_kpis()
+            session.message_post(body=_(
+                "Inventory check completed: %s stockout items, %s below safety stock, %s below reorder point."
+            ) % (session.total_stockout_items, session.total_below_safety, session.total_below_reorder))
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, api
+from odoo.tools import split_every
+from dateutil.relativedelta import relativedelta
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+class ScmConsumptionDaily(models.Model):
+    _name = 'scm.consumption.daily'
+    _description = 'Daily Product Consumption'
+    _order = 'date desc, product_id, warehouse_id'
+    _log_access = False
+
+    product_id = fields.Many2one('product.product', 'Product', required=True, readonly=True, ondelete='cascade')
+    warehouse_id = fields.Many2one('stock.warehouse', 'Warehouse', required=True, readonly=True, ondelete='cascade')
+    date = fields.Date('Date', required=True, readonly=True)
+    quantity = fields.Float('Consumed Quantity', digits='Product Unit of Measure', readonly=True,
+                            help="Quantity delivered to customers or consumed by production, in the product unit of measure")
+
+    _sql_constraints = [
+        ('product_warehouse_date_uniq', 'unique(product_id, warehouse_id, date)',
+         'Consumption is recorded once per product, warehouse and day.'),
+    ]
+
+    # Destination location usages counted as consumption
+    _CONSUMPTION_USAGES = ('customer', 'production')
+
+    def init(self):
+        # Covers the (product, warehouse, date range) lookups of get_consumption
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS scm_consumption_daily_warehouse_date_idx
+            ON scm_consumption_daily (warehouse_id, date, product_id)
+        """)
+
+    @api.model
+    def _add_moves(self, moves):
+        """Add the quantity of done consumption moves to their daily buckets"""
+        buckets = {}
+        for move in moves:
+            if move.state != 'done' or move.location_dest_id.usage not in self._CONSUMPTION_USAGES:
+                continue
+            warehouse = move.location_id.warehouse_id
+            if not warehouse:
+                continue
+            key = (move.product_id.id, warehouse.id, move.date.date())
+            buckets[key] = buckets.get(key, 0.0) + move.product_qty
+        if not buckets:
+            return
+        self.flush_model()
+        for keys in split_every(1000, list(buckets)):
+            query = """
+                INSERT INTO scm_consumption_daily (product_id, warehouse_id, date, quantity)
+                VALUES %s
+                ON CONFLICT (product_id, warehouse_id, date)
+                DO UPDATE SET quantity = scm_consumption_daily.quantity + EXCLUDED.quantity
+            """ % ', '.join(['(%s, %s, %s, %s)'] * len(keys))
+            self.env.cr.execute(query, [value for key in keys for value in key + (buckets[key],)])
+        self.invalidate_model(['quantity'])
+
+    @api.model
+    def _rebuild(self):
+        """Rebuild the whole table from the done stock moves"""
+        self.flush_model()
+        self.env['stock.move'].flush_model(['state', 'date', 'product_id', 'product_qty', 'location_id', 'location_dest_id'])
+        self.env.cr.execute("DELETE FROM scm_consumption_daily")
+        self.env.cr.execute("""
+            INSERT INTO scm_consumption_daily (product_id, warehouse_id, date, quantity)
+            SELECT move.product_id, source.warehouse_id, move.date::date, SUM(move.product_qty)
+              FROM stock_move move
+              JOIN stock_location source ON source.id = move.location_id
+              JOIN stock_location dest ON dest.id = move.location_dest_id
+             WHERE move.state = 'done'
+               AND dest.usage IN %s
+               AND source.warehouse_id IS NOT NULL
+          GROUP BY move.product_id, source.warehouse_id, move.date::date
+        """, [self._CONSUMPTION_USAGES])
+        _logger.info("Rebuilt daily consumption: %d rows", self.env.cr.rowcount)
+        self.invalidate_model()
+        return True
+
+    @api.model
+    def get_consumption(self, products, warehouse=None, days=90):
+        """Return the quantity consumed over the last ``days`` days.
+
+        The result is a dict {product_id: quantity} for the given products, in
+        one grouped query. Without a warehouse, all warehouses are summed.
+        """
+        consumption = dict.fromkeys(products.ids, 0.0)
+        if not products:
+            return consumption
+        domain = [
+            ('product_id', 'in', products.ids),
+            ('date', '>=', fields.Date.today() - relativedelta(days=days)),
+        ]
+        if warehouse:
+            domain.append(('warehouse_id', '=', warehouse.id))
+        for product, quantity in self._read_group(domain, groupby=['product_id'], aggregates=['quantity:sum']):
+            consumption[product.id] = quantity
+        return consumption
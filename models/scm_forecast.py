@@ -4,6 +4,16 @@ from odoo import models, fields, api, _
 from odoo.exceptions import ValidationError
 from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
+from odoo.tools import split_every
+import threading
+
+# Number of periods and duration of each forecast period
+FORECAST_PERIODS = {
+    'daily': {'count': 30, 'delta': timedelta(days=1)},
+    'weekly': {'count': 12, 'delta': timedelta(weeks=1)},
+    'monthly': {'count': 6, 'delta': relativedelta(months=1)},
+    'quarterly': {'count': 4, 'delta': relativedelta(months=3)}
+}
 
 
 class ScmForecast(models.Model):
@@ -28,6 +38,15 @@ class ScmForecast(models.Model):
     ], string='Forecast Period', default='monthly')
     uom_id = fields.Many2one('uom.uom', 'Unit of Measure', related='product_id.uom_id', readonly=True)
     forecast_qty = fields.Float('Forecasted Quantity', required=True)
+    forecast_method = fields.Selection([
+        ('manual', 'Manual'),
+        ('ses', 'Simple Exponential Smoothing'),
+        ('holt_winters', 'Holt-Winters Seasonal'),
+        ('croston', 'Croston (Intermittent Demand)'),
+        ('auto', 'Automatic')
+    ], string='Forecasting Method', default='manual', required=True,
+        help="Statistical model fitted on the daily consumption history. "
+             "Automatic uses Croston for intermittent demand and Holt-Winters otherwise.")
     actual_qty = fields.Float('Actual Quantity', readonly=True)
     variance = fields.Float('Variance', compute='_compute_variance', store=True)
     variance_percent = fields.Float('Variance %', compute='_compute_variance', store=True)
@@ -42,11 +61,19 @@ class ScmForecast(models.Model):
     forecast_line_ids = fields.One2many('scm.forecast.line', 'forecast_id', 'Forecast Lines')
     is_template = fields.Boolean('Is Template', default=False)
     
-    @api.model
-    def create(self, vals):
-        if vals.get('name', _('New')) == _('New'):
-            vals['name'] = self.env['ir.sequence'].next_by_code('scm.forecast') or _('New')
-        return super(ScmForecast, self).create(vals)
+    @api.model_create_multi
+    def create(self, vals_list):
+        for vals in vals_list:
+            if vals.get('name', _('New')) == _('New'):
+                vals['name'] = self.env['ir.sequence'].next_by_code('scm.forecast') or _('New')
+        return super(ScmForecast, self).create(vals_list)
+    
+    def write(self, vals):
+        result = super(ScmForecast, self).write(vals)
+        if 'state' in vals:
+            # Confirmed forecasts count as demand in the quant forecast
+            self.forecast_line_ids._refresh_quant_forecast()
+        return result
     
     @api.depends('forecast_qty', 'actual_qty')
     def _compute_variance(self):
@@ -85,45 +112,80 @@ class ScmForecast(models.Model):
     
     def generate_forecast_lines(self):
         """Generate time-phased forecast lines based on the forecast period"""
+        self._generate_forecast_lines_batch()
+        return True
+    
+    def action_run_statistical_forecast(self):
+        """Compute the forecast quantity and lines from the consumption history"""
+        self.env['scm.forecast.engine'].run(self)
+        return True
+    
+    def _prepare_forecast_line_vals(self, period_qtys=None):
+        """Return the values of the forecast lines of the forecast, with the
+        given quantity of each period or an even split of the forecast"""
         self.ensure_one()
-        if self.forecast_line_ids:
-            self.forecast_line_ids.unlink()
-            
-        forecast_lines = []
         start_date = self.date
         
-        # Define the number of periods and duration based on forecast_period
-        periods = {
-            'daily': {'count': 30, 'delta': timedelta(days=1)},
-            'weekly': {'count': 12, 'delta': timedelta(weeks=1)},
-            'monthly': {'count': 6, 'delta': relativedelta(months=1)},
-            'quarterly': {'count': 4, 'delta': relativedelta(months=3)}
-        }
-        
-        count = periods[self.forecast_period]['count']
-        delta = periods[self.forecast_period]['delta']
+        count = FORECAST_PERIODS[self.forecast_period]['count']
+        delta = FORECAST_PERIODS[self.forecast_period]['delta']
         
+        vals_list = []
         for i in range(count):
             # Create forecast line for each period
             line_date = start_date + (delta * i)
             
             # Distribute forecast quantity based on historical patterns
-            # For now using a simple distribution
-            period_qty = self.forecast_qty / count
+            # or using a simple distribution
+            period_qty = period_qtys[i] if period_qtys else self.forecast_qty / count
             
-            # Create forecast line
-            line_vals = {
+            vals_list.append({
                 'forecast_id': self.id,
                 'date': line_date,
                 'forecast_qty': period_qty,
                 'product_id': self.product_id.id,
                 'warehouse_id': self.warehouse_id.id
-            }
-            forecast_lines.append((0, 0, line_vals))
+            })
+        return vals_list
+    
+    def _generate_forecast_lines_batch(self, batch_size=1000, period_qtys=None):
+        """Regenerate the lines of many forecasts.
+
+        For each batch of forecasts, the old lines are deleted with one SQL
+        query and the new ones are created with one multi-create. The
+        expected inventory of all the new lines is projected once, at the end.
+        ``period_qtys`` optionally maps forecast ids to their period quantities.
+        """
+        period_qtys = period_qtys or {}
+        Line = self.env['scm.forecast.line']
+        for forecast_ids in split_every(batch_size, self.ids):
+            forecasts = self.browse(forecast_ids)
+            old_lines = Line.search([('forecast_id', 'in', forecasts.ids)])
+            quant_keys = old_lines._get_quant_forecast_keys()
+            if old_lines:
+                old_lines.flush_recordset()
+                self.env.cr.execute("DELETE FROM scm_forecast_line WHERE id IN %s", [tuple(old_lines.ids)])
+                Line.invalidate_model()
+                forecasts.invalidate_recordset(['forecast_line_ids'])
             
-        if forecast_lines:
-            self.write({'forecast_line_ids': forecast_lines})
+            vals_list = []
+            for forecast in forecasts.filtered('forecast_period'):
+                vals_list.extend(forecast._prepare_forecast_line_vals(period_qtys.get(forecast.id)))
+            new_lines = Line.with_context(scm_skip_quant_forecast=True).create(vals_list)
+            self.env['stock.quant']._enqueue_forecast_delta(quant_keys | new_lines._get_quant_forecast_keys())
         
+        # Single projection pass for all the lines created above
+        Line.flush_model(['expected_inventory'])
+        return True
+    
+    @api.model
+    def _cron_generate_forecast_lines(self, batch_size=1000):
+        """Regenerate the lines of the open forecasts, committing each batch"""
+        auto_commit = not getattr(threading.current_thread(), 'testing', False)
+        forecasts = self.search([('is_template', '=', False), ('state', 'in', ['draft', 'confirmed'])])
+        for forecast_ids in split_every(batch_size, forecasts.ids):
+            self.browse(forecast_ids)._generate_forecast_lines_batch(batch_size=batch_size)
+            if auto_commit:
+                self.env.cr.commit()
         return True
     
     def copy_from_template(self, template_id):
@@ -174,41 +236,47 @@ class ScmForecastLine(models.Model):
     state = fields.Selection(related='forecast_id.state', string='Status', store=True)
     notes = fields.Text('Notes')
     
+    # Fields whose change affects the planned movement stored on quants
+    _QUANT_FORECAST_FIELDS = {'product_id', 'warehouse_id', 'forecast_qty', 'date'}
+    
+    @api.model_create_multi
+    def create(self, vals_list):
+        lines = super(ScmForecastLine, self).create(vals_list)
+        if not self.env.context.get('scm_skip_quant_forecast'):
+            lines._refresh_quant_forecast()
+        return lines
+    
+    def write(self, vals):
+        if not self._QUANT_FORECAST_FIELDS.intersection(vals):
+            return super(ScmForecastLine, self).write(vals)
+        keys = self._get_quant_forecast_keys()
+        result = super(ScmForecastLine, self).write(vals)
+        self.env['stock.quant']._enqueue_forecast_delta(keys | self._get_quant_forecast_keys())
+        return result
+    
+    def unlink(self):
+        self.env['stock.quant']._enqueue_forecast_delta(self._get_quant_forecast_keys())
+        return super(ScmForecastLine, self).unlink()
+    
+    def _get_quant_forecast_keys(self):
+        """Return the (product_id, location_id) pairs of the forecast demand"""
+        return {(line.product_id.id, line.warehouse_id.lot_stock_id.id) for line in self}
+    
+    def _refresh_quant_forecast(self):
+        self.env['stock.quant']._enqueue_forecast_delta(self._get_quant_forecast_keys())
+    
     @api.depends('product_id', 'warehouse_id', 'date', 'forecast_qty')
     def _compute_expected_inventory(self):
+        lines = self.filtered(lambda l: l.product_id and l.warehouse_id and l.date)
+        # Project current stock and scheduled moves for all the lines at once
+        projection = self.env['scm.inventory.projection'].get_projection(
+            lines.mapped('product_id'), lines.mapped('warehouse_id'), lines.mapped('date')
+        )
+        projected_line_ids = set(lines.ids)
         for line in self:
-            # Get current stock
-            stock_quant = self.env['stock.quant'].search([
-                ('product_id', '=', line.product_id.id),
-                ('location_id.warehouse_id', '=', line.warehouse_id.id),
-                ('location_id.usage', '=', 'internal')
-            ])
-            
-            current_qty = sum(stock_quant.mapped('quantity')) if stock_quant else 0
-            
-            # Get incoming stock before the forecast date
-            incoming_domain = [
-                ('product_id', '=', line.product_id.id),
-                ('location_dest_id.warehouse_id', '=', line.warehouse_id.id),
-                ('location_dest_id.usage', '=', 'internal'),
-                ('state', 'in', ['assigned', 'partially_available']),
-                ('date', '<=', line.date)
-            ]
-            
-            incoming_moves = self.env['stock.move'].search(incoming_domain)
-            incoming_qty = sum(incoming_moves.mapped('product_qty')) if incoming_moves else 0
-            
-            # Get outgoing stock before the forecast date
-            outgoing_domain = [
-                ('product_id', '=', line.product_id.id),
-                ('location_id.warehouse_id', '=', line.warehouse_id.id),
-                ('location_id.usage', '=', 'internal'),
-                ('state', 'in', ['assigned', 'partially_available']),
-                ('date', '<=', line.date)
-            ]
-            
-            outgoing_moves = self.env['stock.move'].search(outgoing_domain)
-            outgoing_qty = sum(outgoing_moves.mapped('product_qty')) if outgoing_moves else 0
-            
+            if line.id in projected_line_ids:
+                projected_qty = projection[line.product_id.id, line.warehouse_id.id][line.date]
+            else:
+                projected_qty = 0.0
             # Calculate expected inventory
-            line.expected_inventory = current_qty + incoming_qty - outgoing_qty - line.forecast_qty
\ No newline at end of file
+            line.expected_inventory = projected_qty - line.forecast_qty
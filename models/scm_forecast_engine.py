@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError
+from odoo.tools import split_every
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from functools import partial
+import logging
+import threading
+
+from .scm_forecast import FORECAST_PERIODS
+
+_logger = logging.getLogger(__name__)
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+    _logger.info("NumPy is not installed: statistical forecasts are unavailable")
+
+
+# Statistical models, vectorized over the rows of a (products x days) demand matrix.
+# They are plain functions so that they can run in worker processes.
+
+def _forecast_ses(demand, horizon, alpha=0.3, **params):
+    """Simple exponential smoothing: flat forecast at the smoothed level"""
+    level = demand[:, 0].astype(float)
+    for t in range(1, demand.shape[1]):
+        level = alpha * demand[:, t] + (1 - alpha) * level
+    return np.repeat(level[:, None], horizon, axis=1)
+
+
+def _forecast_holt_winters(demand, horizon, alpha=0.3, beta=0.05, gamma=0.1, season_length=7, **params):
+    """Additive Holt-Winters with a trend and a seasonal cycle"""
+    m = season_length
+    rows, days = demand.shape
+    if days < 2 * m:
+        return _forecast_ses(demand, horizon, alpha=alpha)
+    first, second = demand[:, :m].mean(axis=1), demand[:, m:2 * m].mean(axis=1)
+    level = first.astype(float)
+    trend = (second - first) / m
+    season = demand[:, :m] - first[:, None]
+    for t in range(m, days):
+        seasonal = season[:, t % m]
+        previous_level = level
+        level = alpha * (demand[:, t] - seasonal) + (1 - alpha) * (level + trend)
+        trend = beta * (level - previous_level) + (1 - beta) * trend
+        season[:, t % m] = gamma * (demand[:, t] - level) + (1 - gamma) * seasonal
+    steps = np.arange(1, horizon + 1)
+    forecast = level[:, None] + steps[None, :] * trend[:, None] + season[:, (days + steps - 1) % m]
+    return np.maximum(forecast, 0.0)
+
+
+def _forecast_croston(demand, horizon, alpha=0.1, **params):
+    """Croston's method for intermittent demand: smoothed size over smoothed interval"""
+    nonzero = demand > 0
+    counts = nonzero.sum(axis=1)
+    # Start from the average demand size and interval of the history
+    size = np.where(counts > 0, demand.sum(axis=1) / np.maximum(counts, 1), 0.0)
+    interval = np.where(counts > 0, demand.shape[1] / np.maximum(counts, 1), 1.0)
+    elapsed = np.ones(demand.shape[0])
+    for t in range(demand.shape[1]):
+        occurs = nonzero[:, t]
+        size = np.where(occurs, alpha * demand[:, t] + (1 - alpha) * size, size)
+        interval = np.where(occurs, alpha * elapsed + (1 - alpha) * interval, interval)
+        elapsed = np.where(occurs, 1.0, elapsed + 1.0)
+    rate = np.where(size > 0, size / interval, 0.0)
+    return np.repeat(rate[:, None], horizon, axis=1)
+
+
+_MODELS = {
+    'ses': _forecast_ses,
+    'holt_winters': _forecast_holt_winters,
+    'croston': _forecast_croston,
+}
+
+
+def _forecast_rows(demand, methods, horizon, params):
+    """Forecast every row of the demand matrix with its own method"""
+    forecast = np.zeros((demand.shape[0], horizon))
+    if not demand.shape[1]:
+        # No history to fit: nothing is forecast
+        return forecast
+    for method, model in _MODELS.items():
+        rows = methods == method
+        if rows.any():
+            forecast[rows] = model(demand[rows], horizon, **params)
+    return forecast
+
+
+class ScmForecastEngine(models.AbstractModel):
+    _name = 'scm.forecast.engine'
+    _description = 'Statistical Forecasting Engine'
+
+    @api.model
+    def _get_params(self):
+        """Smoothing parameters and history length, from system parameters"""
+        get_param = self.env['ir.config_parameter'].sudo().get_param
+        return {
+            'history_days': int(get_param('scm_procurement.forecast_history_days', 365)),
+            'workers': int(get_param('scm_procurement.forecast_workers', 0)),
+            'alpha': float(get_param('scm_procurement.forecast_alpha', 0.3)),
+            'beta': float(get_param('scm_procurement.forecast_beta', 0.05)),
+            'gamma': float(get_param('scm_procurement.forecast_gamma', 0.1)),
+            'season_length': int(get_param('scm_procurement.forecast_season_length', 7)),
+        }
+
+    @api.model
+    def _get_demand_matrix(self, products, warehouse, date_from, date_to):
+        """Daily consumption of the products between two dates, as a
+        (products x days) matrix, from one grouped query"""
+        days = (date_to - date_from).days
+        demand = np.zeros((len(products), days))
+        row_by_product = {product_id: row for row, product_id in enumerate(products.ids)}
+        for product, day, quantity in self.env['scm.consumption.daily']._read_group(
+            [
+                ('product_id', 'in', products.ids),
+                ('warehouse_id', '=', warehouse.id),
+                ('date', '>=', date_from),
+                ('date', '<', date_to),
+            ],
+            groupby=['product_id', 'date:day'],
+            aggregates=['quantity:sum'],
+        ):
+            demand[row_by_product[product.id], (fields.Date.to_date(day) - date_from).days] = quantity
+        return demand
+
+    @api.model
+    def _select_methods(self, demand, requested, season_length):
+        """Resolve the 'auto' method of each row from its demand pattern"""
+        methods = np.array(requested, dtype=object)
+        auto = methods == 'auto'
+        if auto.any() and demand.shape[1]:
+            # Mostly zero demand is intermittent; seasonality needs two full cycles
+            intermittent = (demand == 0).mean(axis=1) > 0.5
+            seasonal = demand.shape[1] >= 2 * season_length
+            methods[auto & intermittent] = 'croston'
+            methods[auto & ~intermittent] = 'holt_winters' if seasonal else 'ses'
+        elif auto.any():
+            methods[auto] = 'ses'
+        return methods
+
+    @api.model
+    def _forecast(self, demand, horizon, methods, params):
+        """Run the models, fanned out to worker processes when configured"""
+        model_params = {key: params[key] for key in ('alpha', 'beta', 'gamma', 'season_length')}
+        workers = params['workers']
+        if workers > 1 and demand.shape[0] > workers:
+            chunks = np.array_split(np.arange(demand.shape[0]), workers)
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = executor.map(
+                    partial(_forecast_rows, horizon=horizon, params=model_params),
+                    [demand[rows] for rows in chunks],
+                    [methods[rows] for rows in chunks],
+                )
+                return np.vstack(list(results))
+        return _forecast_rows(demand, methods, horizon, model_params)
+
+    @api.model
+    def run(self, forecasts, batch_size=5000):
+        """Forecast the demand of the forecasts and write their quantity and lines.
+
+        Forecasts sharing a warehouse, a start date and a period are fitted
+        together, in batches of products.
+        """
+        if np is None:
+            raise UserError(_("Statistical forecasts require the NumPy Python library."))
+        params = self._get_params()
+
+        groups = {}
+        for forecast in forecasts.filtered(lambda f: f.forecast_period and f.forecast_method != 'manual'):
+            groups.setdefault((forecast.warehouse_id, forecast.date, forecast.forecast_period), []).append(forecast.id)
+
+        period_qtys = {}
+        for (warehouse, date, period), forecast_ids in groups.items():
+            count = FORECAST_PERIODS[period]['count']
+            delta = FORECAST_PERIODS[period]['delta']
+            # Day offsets of the period boundaries from the start date
+            bounds = np.array([((date + delta * i) - date).days for i in range(count + 1)])
+            date_from = date - timedelta(days=params['history_days'])
+
+            for batch_ids in split_every(batch_size, forecast_ids):
+                batch = self.env['scm.forecast'].browse(batch_ids)
+                products = batch.mapped('product_id')
+                demand = self._get_demand_matrix(products, warehouse, date_from, date)
+                row_by_product = {product_id: row for row, product_id in enumerate(products.ids)}
+
+                # One method per product: the first forecast of a product wins
+                requested = ['auto'] * len(products)
+                for forecast in reversed(batch):
+                    requested[row_by_product[forecast.product_id.id]] = forecast.forecast_method
+                methods = self._select_methods(demand, requested, params['season_length'])
+
+                daily = self._forecast(demand, int(bounds[-1]), methods, params)
+                cumulative = np.hstack([np.zeros((daily.shape[0], 1)), daily.cumsum(axis=1)])
+                per_period = cumulative[:, bounds[1:]] - cumulative[:, bounds[:-1]]
+
+                for forecast in batch:
+                    period_qtys[forecast.id] = per_period[row_by_product[forecast.product_id.id]].tolist()
+
+        forecasts = self.env['scm.forecast'].browse(list(period_qtys))
+        self._write_forecast_qtys({
+            forecast_id: sum(quantities) for forecast_id, quantities in period_qtys.items()
+        })
+        forecasts._generate_forecast_lines_batch(period_qtys=period_qtys)
+        _logger.info("Statistical forecast computed for %d forecasts", len(forecasts))
+        return forecasts
+
+    @api.model
+    def _write_forecast_qtys(self, forecast_qtys):
+        """Set the quantity of many forecasts with one UPDATE per chunk"""
+        if not forecast_qtys:
+            return
+        Forecast = self.env['scm.forecast']
+        Forecast.flush_model(['forecast_qty'])
+        for forecast_ids in split_every(1000, list(forecast_qtys)):
+            query = """
+                UPDATE scm_forecast forecast
+                   SET forecast_qty = value.qty
+                  FROM (VALUES %s) AS value(id, qty)
+                 WHERE forecast.id = value.id
+            """ % ', '.join(['(%s, %s::float8)'] * len(forecast_ids))
+            self.env.cr.execute(query, [
+                value for forecast_id in forecast_ids for value in (forecast_id, forecast_qtys[forecast_id])
+            ])
+        forecasts = Forecast.browse(list(forecast_qtys))
+        forecasts.invalidate_recordset(['forecast_qty'])
+        # Recompute the fields depending on the quantity, like the variance
+        forecasts.modified(['forecast_qty'])
+
+    @api.model
+    def _cron_run_forecasts(self, batch_size=5000):
+        """Nightly re-forecast of the open statistical forecasts"""
+        auto_commit = not getattr(threading.current_thread(), 'testing', False)
+        forecasts = self.env['scm.forecast'].search([
+            ('is_template', '=', False),
+            ('state', 'in', ['draft', 'confirmed']),
+            ('forecast_method', '!=', 'manual'),
+        ])
+        for forecast_ids in split_every(batch_size, forecasts.ids):
+            self.run(self.env['scm.forecast'].browse(forecast_ids), batch_size=batch_size)
+            if auto_commit:
+                self.env.cr.commit()
+        return True
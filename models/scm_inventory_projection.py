@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, api
+from bisect import bisect_left
+from itertools import accumulate
+
+
+class ScmInventoryProjection(models.AbstractModel):
+    _name = 'scm.inventory.projection'
+    _description = 'Projected Inventory Service'
+
+    @api.model
+    def get_projection(self, products, warehouses, dates):
+        """Project the inventory of many products and warehouses over time.
+
+        Current stock and scheduled moves are loaded once for all the
+        (product, warehouse) pairs and bucketed by day. The projection at a
+        date is the current stock plus the cumulative sum of the net moves
+        scheduled before that date.
+
+        Returns a dict {(product_id, warehouse_id): {date: quantity}} for
+        every pair and every date given.
+        """
+        dates = sorted(set(dates))
+        projection = {
+            (product_id, warehouse_id): dict.fromkeys(dates, 0.0)
+            for product_id in products.ids for warehouse_id in warehouses.ids
+        }
+        if not projection or not dates:
+            return projection
+
+        current = dict.fromkeys(projection, 0.0)
+        deltas = {key: {} for key in projection}
+        domain = [('product_id', 'in', products.ids)]
+
+        # Current stock of the internal locations of each warehouse
+        for product, location, quantity in self.env['stock.quant']._read_group(
+            domain + [('location_id.usage', '=', 'internal'), ('location_id.warehouse_id', 'in', warehouses.ids)],
+            groupby=['product_id', 'location_id'],
+            aggregates=['quantity:sum'],
+        ):
+            current[product.id, location.warehouse_id.id] += quantity
+
+        # Scheduled moves entering and leaving the warehouses, bucketed by day
+        move_domain = domain + [
+            ('state', 'in', ['assigned', 'partially_available']),
+            ('date', '<', dates[-1]),
+        ]
+        for location_field, sign in (('location_dest_id', 1), ('location_id', -1)):
+            for product, location, day, quantity in self.env['stock.move']._read_group(
+                move_domain + [
+                    ('%s.usage' % location_field, '=', 'internal'),
+                    ('%s.warehouse_id' % location_field, 'in', warehouses.ids),
+                ],
+                groupby=['product_id', location_field, 'date:day'],
+                aggregates=['product_qty:sum'],
+            ):
+                key_deltas = deltas[product.id, location.warehouse_id.id]
+                day = fields.Date.to_date(day)
+                key_deltas[day] = key_deltas.get(day, 0.0) + sign * quantity
+
+        for key, key_deltas in deltas.items():
+            days = sorted(key_deltas)
+            # Running stock after each day with scheduled moves
+            running = list(accumulate((key_deltas[day] for day in days), initial=current[key]))
+            for date in dates:
+                # Moves of the days before the date are received or shipped by then
+                projection[key][date] = running[bisect_left(days, date)]
+        return projection
@@ -1,8 +1,7 @@
 # -*- coding: utf-8 -*-
 
-from odoo import models, fields, api, _
+from odoo import models, fields, api, tools, _
 from odoo.exceptions import ValidationError
-from dateutil.relativedelta import relativedelta
 
 
 class ScmInventoryRule(models.Model):
@@ -32,6 +31,16 @@ class ScmInventoryRule(models.Model):
     uom_id = fields.Many2one('uom.uom', 'Unit of Measure', related='product_id.uom_id', readonly=True)
     warehouse_id = fields.Many2one('stock.warehouse', 'Warehouse')
     
+    # Fields whose change affects the stock status stored on quants
+    _STOCK_STATUS_FIELDS = {
+        'active', 'company_id', 'product_id', 'product_category_id', 'warehouse_id',
+        'safety_stock_qty', 'reorder_point',
+    }
+    # Fields read by the cached rule index
+    _RULE_INDEX_FIELDS = {
+        'active', 'company_id', 'product_id', 'product_category_id', 'warehouse_id',
+    }
+    
     @api.constrains('product_id', 'product_category_id')
     def _check_product_or_category(self):
         for rule in self:
@@ -48,28 +57,22 @@ class ScmInventoryRule(models.Model):
             if rule.safety_stock_qty > rule.min_stock_qty:
                 raise ValidationError(_("Safety stock should not be greater than minimum stock."))
     
-    @api.depends('product_id')
+    @api.depends('product_id', 'warehouse_id')
     def _compute_avg_daily_usage(self):
+        # Calculate the average daily usage based on the last 90 days of consumption,
+        # with one grouped query per warehouse
+        rules_by_warehouse = {}
         for rule in self:
+            rule.avg_daily_usage = 0.0
             if rule.product_id:
-                # Calculate the average daily usage based on the last 90 days of stock moves
-                date_from = fields.Date.today() - relativedelta(days=90)
-                domain = [
-                    ('product_id', '=', rule.product_id.id),
-                    ('state', '=', 'done'),
-                    ('date', '>=', date_from)
-                ]
-                
-                # Get outgoing moves (typically to customers or for production)
-                moves = self.env['stock.move'].search(domain + [('location_dest_id.usage', 'in', ['customer', 'production'])])
-                
-                if moves:
-                    total_qty = sum(move.product_qty for move in moves)
-                    rule.avg_daily_usage = total_qty / 90.0
-                else:
-                    rule.avg_daily_usage = 0.0
-            else:
-                rule.avg_daily_usage = 0.0
+                rules_by_warehouse.setdefault(rule.warehouse_id, []).append(rule)
+
+        Consumption = self.env['scm.consumption.daily']
+        for warehouse, rules in rules_by_warehouse.items():
+            products = self.env['product.product'].browse({rule.product_id.id for rule in rules})
+            consumption = Consumption.get_consumption(products, warehouse or None, days=90)
+            for rule in rules:
+                rule.avg_daily_usage = consumption[rule.product_id.id] / 90.0
     
     def calculate_safety_stock(self):
         """Calculate safety stock based on average daily usage and lead time"""
@@ -89,43 +92,145 @@ class ScmInventoryRule(models.Model):
             self.write({'reorder_point': reorder})
         return True
     
+    @api.model_create_multi
+    def create(self, vals_list):
+        rules = super(ScmInventoryRule, self).create(vals_list)
+        self.env.registry.clear_cache()
+        rules._enqueue_stock_status()
+        return rules
+
+    def write(self, vals):
+        status_changed = bool(self._STOCK_STATUS_FIELDS.intersection(vals))
+        if status_changed:
+            self._enqueue_stock_status()
+        result = super(ScmInventoryRule, self).write(vals)
+        if self._RULE_INDEX_FIELDS.intersection(vals):
+            self.env.registry.clear_cache()
+        if status_changed:
+            self._enqueue_stock_status()
+        return result
+
+    def unlink(self):
+        self._enqueue_stock_status()
+        result = super(ScmInventoryRule, self).unlink()
+        self.env.registry.clear_cache()
+        return result
+
+    def _enqueue_stock_status(self):
+        """Queue the quants whose stock status depends on these rules.
+
+        Product and category rules queue their (product, warehouse) pairs;
+        a default rule may apply to any product, so it triggers a full rebuild.
+        """
+        keys = set()
+        category_rules = self.browse()
+        for rule in self:
+            if rule.product_id:
+                keys.add((rule.product_id.id, rule.warehouse_id.id))
+            elif rule.product_category_id:
+                category_rules |= rule
+            else:
+                cron = self.env.ref('scm_procurement.ir_cron_scm_rebuild_stock_status', raise_if_not_found=False)
+                if cron:
+                    cron._trigger()
+        for rule in category_rules:
+            product_ids = self.env['product.product'].with_context(active_test=False).search([
+                ('categ_id', 'child_of', rule.product_category_id.id)
+            ]).ids
+            keys.update((product_id, rule.warehouse_id.id) for product_id in product_ids)
+        if keys:
+            self.env['stock.quant']._enqueue_stock_status(keys)
+
     @api.model
-    def get_applicable_rule(self, product, warehouse=None):
-        """Find the most specific applicable rule for a product"""
-        domain = [('active', '=', True)]
-        
-        if warehouse:
-            domain += ['|', ('warehouse_id', '=', warehouse.id), ('warehouse_id', '=', False)]
-            
+    @tools.ormcache('company_id')
+    def _get_rule_index(self, company_id):
+        """Load the active rules of a company into lookup dictionaries.
+
+        Product and category rules are keyed by (record id, warehouse id),
+        with ``False`` for rules valid in every warehouse and ``None`` for
+        lookups made without a warehouse. Default rules are keyed by
+        warehouse id only. The first rule in ``_order`` wins on each key.
+        """
+        index = {'product': {}, 'category': {}, 'default': {}}
+        rules = self.sudo().search_read(
+            [('active', '=', True), ('company_id', '=', company_id)],
+            ['product_id', 'product_category_id', 'warehouse_id'],
+            order=self._order + ', id',
+        )
+        for rule in rules:
+            warehouse_id = rule['warehouse_id'] and rule['warehouse_id'][0]
+            if rule['product_id']:
+                table, key = index['product'], rule['product_id'][0]
+            elif rule['product_category_id']:
+                table, key = index['category'], rule['product_category_id'][0]
+            else:
+                table, key = index['default'], None
+            if key is None:
+                table.setdefault(warehouse_id, rule['id'])
+                table.setdefault(None, rule['id'])
+            else:
+                table.setdefault((key, warehouse_id), rule['id'])
+                table.setdefault((key, None), rule['id'])
+        return index
+
+    @api.model
+    def _resolve_rule_id(self, index, product, warehouse=None):
+        """Return the id of the most specific rule for a product, or False"""
+        warehouse_keys = (warehouse.id, False) if warehouse else (None,)
+
         # Try to find a rule specific to this product
         if product:
-            product_rules = self.search(domain + [('product_id', '=', product.id)], limit=1)
-            if product_rules:
-                return product_rules[0]
-                
-            # If no product-specific rule, check for category rule
-            category_rules = self.search(domain + [
-                ('product_category_id', '=', product.categ_id.id),
-                ('product_id', '=', False)
-            ], limit=1)
-            if category_rules:
-                return category_rules[0]
-                
-            # Look for parent category rules if no direct category rule
-            parent_category = product.categ_id.parent_id
-            while parent_category and not category_rules:
-                category_rules = self.search(domain + [
-                    ('product_category_id', '=', parent_category.id),
-                    ('product_id', '=', False)
-                ], limit=1)
-                if category_rules:
-                    return category_rules[0]
-                parent_category = parent_category.parent_id
-        
+            for warehouse_key in warehouse_keys:
+                rule_id = index['product'].get((product.id, warehouse_key))
+                if rule_id:
+                    return rule_id
+
+            # Then climb the category tree, from the product category up
+            category_path = product.categ_id.parent_path or ''
+            for category_id in reversed([int(cid) for cid in category_path.split('/') if cid]):
+                for warehouse_key in warehouse_keys:
+                    rule_id = index['category'].get((category_id, warehouse_key))
+                    if rule_id:
+                        return rule_id
+
         # Return default rule if exists
-        default_rule = self.search(domain + [
-            ('product_id', '=', False),
-            ('product_category_id', '=', False)
-        ], limit=1)
-        
-        return default_rule if default_rule else False
\ No newline at end of file
+        for warehouse_key in warehouse_keys:
+            rule_id = index['default'].get(warehouse_key)
+            if rule_id:
+                return rule_id
+        return False
+
+    @api.model
+    def _get_rule_company_id(self, warehouse=None, company=None):
+        """Return the company whose rules apply: the warehouse company first,
+        then the given company, then the current one"""
+        if warehouse and warehouse.company_id:
+            return warehouse.company_id.id
+        return (company or self.env.company).id
+
+    @api.model
+    def get_applicable_rule(self, product, warehouse=None, company=None):
+        """Find the most specific applicable rule for a product"""
+        index = self._get_rule_index(self._get_rule_company_id(warehouse, company))
+        rule_id = self._resolve_rule_id(index, product, warehouse)
+        return self.browse(rule_id) if rule_id else False
+
+    @api.model
+    def get_applicable_rules(self, products, warehouse=None, company=None):
+        """Find the most specific applicable rule for many products at once.
+
+        Returns a dict {product_id: rule}, where rule is an empty recordset
+        when no rule applies to the product. The rules are those of the
+        warehouse company, or of ``company`` when no warehouse is given.
+        """
+        index = self._get_rule_index(self._get_rule_company_id(warehouse, company))
+        rule_ids = {
+            product.id: self._resolve_rule_id(index, product, warehouse)
+            for product in products
+        }
+        # Share the prefetch so reading the rules takes a single query
+        prefetch_ids = tuple({rule_id for rule_id in rule_ids.values() if rule_id})
+        return {
+            product_id: self.browse(rule_id or []).with_prefetch(prefetch_ids)
+            for product_id, rule_id in rule_ids.items()
+        }
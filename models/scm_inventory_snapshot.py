@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, api
+from dateutil.relativedelta import relativedelta
+
+
+class ScmInventorySnapshot(models.AbstractModel):
+    _name = 'scm.inventory.snapshot'
+    _description = 'Inventory Snapshot Service'
+
+    @api.model
+    def get_snapshot(self, products, warehouse, usage_days=90, forecast_days=30):
+        """Collect inventory figures for many products of one warehouse.
+
+        All figures are fetched with a handful of grouped queries keyed by
+        product and returned as a dict {product_id: values} where values holds
+        ``onhand_qty``, ``forecasted_qty``, ``consumed_qty`` (over the last
+        ``usage_days`` days) and ``expected_receipt_date``.
+        """
+        snapshot = {
+            product.id: {
+                'onhand_qty': 0.0,
+                'forecasted_qty': 0.0,
+                'consumed_qty': 0.0,
+                'expected_receipt_date': False,
+            } for product in products
+        }
+        stock_location = warehouse.lot_stock_id
+        if not products or not stock_location:
+            return snapshot
+
+        product_ids = products.ids
+        Move = self.env['stock.move']
+        now = fields.Datetime.now()
+
+        # On-hand quantity, computed in batch by the product model
+        for product in products.with_context(location=stock_location.id):
+            snapshot[product.id]['onhand_qty'] = product.qty_available
+
+        # Forecasted quantity of the quants held in the stock location
+        quant_qty = dict(self.env['stock.quant']._read_group(
+            [('product_id', 'in', product_ids), ('location_id', '=', stock_location.id)],
+            groupby=['product_id'],
+            aggregates=['quantity:sum'],
+        ))
+        if quant_qty:
+            deltas = self.env['stock.quant']._get_forecast_deltas(
+                set(product_ids), {stock_location.id}, days=forecast_days
+            )
+            for product, quantity in quant_qty.items():
+                snapshot[product.id]['forecasted_qty'] = quantity + deltas.get((product.id, stock_location.id), 0.0)
+
+        # Consumption (deliveries and production) over the usage window
+        consumption = self.env['scm.consumption.daily'].get_consumption(products, warehouse, days=usage_days)
+        for product_id, quantity in consumption.items():
+            snapshot[product_id]['consumed_qty'] = quantity
+
+        # First scheduled receipt in the warehouse
+        for product, first_date in Move._read_group(
+            [
+                ('product_id', 'in', product_ids),
+                ('location_dest_id.warehouse_id', '=', warehouse.id),
+                ('location_dest_id.usage', '=', 'internal'),
+                ('state', 'in', ['assigned', 'partially_available']),
+                ('date', '>=', now),
+            ],
+            groupby=['product_id'],
+            aggregates=['date:min'],
+        ):
+            snapshot[product.id]['expected_receipt_date'] = first_date.date() if first_date else False
+
+        return snapshot
+
+    @api.model
+    def get_availability_matrix(self, products, company=None):
+        """Quantity available in each warehouse for many products.
+
+        Internal quants are summed with one grouped query and returned as a
+        dict {product_id: {warehouse_id: available_qty}}, where the available
+        quantity excludes the reserved quantity.
+        """
+        company = company or self.env.company
+        matrix = {product_id: {} for product_id in products.ids}
+        if not products:
+            return matrix
+        for product, location, quantity, reserved_quantity in self.env['stock.quant']._read_group(
+            [
+                ('product_id', 'in', products.ids),
+                ('location_id.usage', '=', 'internal'),
+                ('company_id', '=', company.id),
+            ],
+            groupby=['product_id', 'location_id'],
+            aggregates=['quantity:sum', 'reserved_quantity:sum'],
+        ):
+            warehouse = location.warehouse_id
+            if not warehouse:
+                continue
+            by_warehouse = matrix[product.id]
+            by_warehouse[warehouse.id] = by_warehouse.get(warehouse.id, 0.0) + quantity - reserved_quantity
+        return matrix
+
+    @api.model
+    def get_procurement_history(self, products, warehouses, usage_days=90):
+        """Last purchase and usage of many products in many warehouses.
+
+        Returns a dict {(product_id, warehouse_id): values} where values holds
+        ``last_purchase_date``, ``last_purchase_price`` and ``monthly_usage``
+        (average over ``usage_days``). It takes one windowed query on the
+        confirmed PO lines and one grouped query on the consumption table.
+        """
+        history = {
+            (product_id, warehouse_id): {
+                'last_purchase_date': False,
+                'last_purchase_price': 0.0,
+                'monthly_usage': 0.0,
+            } for product_id in products.ids for warehouse_id in warehouses.ids
+        }
+        if not history:
+            return history
+
+        # Latest confirmed PO line of each product received in each warehouse
+        self.env['purchase.order.line'].flush_model(['product_id', 'order_id', 'state', 'price_unit', 'create_date'])
+        self.env['purchase.order'].flush_model(['picking_type_id', 'date_order', 'company_id'])
+        self.env.cr.execute("""
+            SELECT DISTINCT ON (line.product_id, picking_type.warehouse_id)
+                   line.product_id, picking_type.warehouse_id, po.date_order, line.price_unit
+              FROM purchase_order_line line
+              JOIN purchase_order po ON po.id = line.order_id
+              JOIN stock_picking_type picking_type ON picking_type.id = po.picking_type_id
+             WHERE line.state = 'purchase'
+               AND line.product_id IN %s
+               AND picking_type.warehouse_id IN %s
+               AND po.company_id IN %s
+          ORDER BY line.product_id, picking_type.warehouse_id, line.create_date DESC, line.id DESC
+        """, [tuple(products.ids), tuple(warehouses.ids), tuple(self.env.companies.ids)])
+        for product_id, warehouse_id, date_order, price_unit in self.env.cr.fetchall():
+            history[product_id, warehouse_id].update({
+                'last_purchase_date': date_order.date() if date_order else False,
+                'last_purchase_price': price_unit,
+            })
+
+        # Consumption of each product in each warehouse
+        months = usage_days / 30.0
+        for product, warehouse, quantity in self.env['scm.consumption.daily']._read_group(
+            [
+                ('product_id', 'in', products.ids),
+                ('warehouse_id', 'in', warehouses.ids),
+                ('date', '>=', fields.Date.today() - relativedelta(days=usage_days)),
+            ],
+            groupby=['product_id', 'warehouse_id'],
+            aggregates=['quantity:sum'],
+        ):
+            history[product.id, warehouse.id]['monthly_usage'] = quantity / months
+        return history
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, api
+from contextlib import contextmanager
+import logging
+import threading
+import time
+
+_logger = logging.getLogger(__name__)
+
+
+class ScmPerfTrace(models.Model):
+    _name = 'scm.perf.trace'
+    _description = 'Consolidation Performance Trace'
+    _order = 'date_start, id'
+
+    session_id = fields.Many2one(
+        'scm.pr.consolidation.session',
+        string='Consolidation Session',
+        required=True,
+        ondelete='cascade',
+        index=True
+    )
+    company_id = fields.Many2one(related='session_id.company_id', store=True)
+    phase = fields.Selection([
+        ('consolidation', 'Consolidation'),
+        ('inventory_check', 'Inventory Check'),
+        ('inventory_validation', 'Inventory Validation Wizard'),
+        ('po_creation', 'PO Creation'),
+    ], string='Phase', required=True)
+    user_id = fields.Many2one('res.users', string='User', default=lambda self: self.env.user)
+    date_start = fields.Datetime(string='Started On', required=True)
+    query_count = fields.Integer(string='SQL Queries')
+    sql_time = fields.Float(string='SQL Time (s)', digits=(16, 3))
+    python_time = fields.Float(string='Python Time (s)', digits=(16, 3))
+    total_time = fields.Float(string='Total Time (s)', digits=(16, 3))
+    records_count = fields.Integer(string='Records Touched')
+
+    @api.model
+    @contextmanager
+    def _trace(self, session, phase):
+        """Measure the block and store its metrics on the session.
+
+        Yields a dict where the block can set ``records`` to the number of
+        records it touched. Nothing is measured when tracing is disabled on
+        the session company.
+        """
+        metrics = {'records': 0}
+        if not session or not session.company_id.scm_perf_trace_enabled:
+            yield metrics
+            return
+
+        cr = self.env.cr
+        thread = threading.current_thread()
+        # The cursor accumulates its SQL time on the thread when the counters exist
+        if not hasattr(thread, 'query_time'):
+            thread.query_count = 0
+            thread.query_time = 0.0
+        date_start = fields.Datetime.now()
+        query_count = cr.sql_log_count
+        query_time = thread.query_time
+        start = time.perf_counter()
+
+        yield metrics
+
+        self.env.flush_all()
+        total_time = time.perf_counter() - start
+        sql_time = thread.query_time - query_time
+        self.sudo().create({
+            'session_id': session.id,
+            'phase': phase,
+            'date_start': date_start,
+            'query_count': cr.sql_log_count - query_count,
+            'sql_time': sql_time,
+            'python_time': max(total_time - sql_time, 0.0),
+            'total_time': total_time,
+            'records_count': metrics['records'],
+        })
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, api
+
+
+class ScmPriceMatrix(models.AbstractModel):
+    _name = 'scm.price.matrix'
+    _description = 'Vendor Price Matrix Service'
+
+    @api.model
+    def get_matrix(self, products, company=None):
+        """Load the vendor prices of many products with one query.
+
+        Returns a dict {product_tmpl_id: [entry, ...]} where each entry holds
+        ``partner_id``, ``product_id`` (False for template-wide prices),
+        ``min_qty``, ``price``, ``date_start`` and ``date_end``, cheapest first.
+        """
+        company = company or self.env.company
+        matrix = {}
+        if not products:
+            return matrix
+        infos = self.env['product.supplierinfo'].search_read([
+            ('product_tmpl_id', 'in', products.product_tmpl_id.ids),
+            ('company_id', 'in', [company.id, False]),
+        ], ['product_tmpl_id', 'product_id', 'partner_id', 'min_qty', 'price', 'date_start', 'date_end'],
+            order='price, sequence, min_qty desc, id')
+        for info in infos:
+            matrix.setdefault(info['product_tmpl_id'][0], []).append({
+                'partner_id': info['partner_id'][0],
+                'product_id': info['product_id'] and info['product_id'][0],
+                'min_qty': info['min_qty'],
+                'price': info['price'],
+                'date_start': info['date_start'],
+                'date_end': info['date_end'],
+            })
+        return matrix
+
+    @api.model
+    def best_price(self, matrix, product, quantity=0.0, date=None, vendor=None):
+        """Return the cheapest entry of the matrix valid for the product, the
+        quantity, the date and optionally the vendor, or None"""
+        date = date or fields.Date.context_today(self)
+        for entry in matrix.get(product.product_tmpl_id.id, []):
+            if entry['product_id'] and entry['product_id'] != product.id:
+                continue
+            if vendor and entry['partner_id'] != vendor.id:
+                continue
+            if quantity and entry['min_qty'] > quantity:
+                continue
+            if (entry['date_start'] and entry['date_start'] > date) or (entry['date_end'] and entry['date_end'] < date):
+                continue
+            return entry
+        return None
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, api
+
+
+class ScmVendorIndex(models.AbstractModel):
+    _name = 'scm.vendor.index'
+    _description = 'Vendor Resolution Service'
+
+    @api.model
+    def get_vendors(self, products, sources=('agreement', 'history'), company=None):
+        """Resolve a vendor for many products at once.
+
+        Each source is loaded with one query for all the products, then the
+        vendor of a product is taken from the first source that knows it.
+        Returns a dict {product_id: partner}, where partner is an empty
+        recordset when no source has a vendor for the product.
+        """
+        company = company or self.env.company
+        index = {source: getattr(self, '_index_%s' % source)(products, company) for source in sources}
+        vendors = {}
+        for product in products:
+            vendor_id = False
+            for source in sources:
+                vendor_id = index[source].get(product.id)
+                if vendor_id:
+                    break
+            vendors[product.id] = vendor_id
+        prefetch_ids = tuple({vendor_id for vendor_id in vendors.values() if vendor_id})
+        return {
+            product_id: self.env['res.partner'].browse(vendor_id or []).with_prefetch(prefetch_ids)
+            for product_id, vendor_id in vendors.items()
+        }
+
+    @api.model
+    def _index_agreement(self, products, company):
+        """Vendor of the most recent active agreement covering each product"""
+        agreements = self.env['purchase.requisition'].search([
+            ('state', '=', 'active'),
+            ('company_id', '=', company.id),
+            ('line_ids.product_id', 'in', products.ids),
+        ], order='create_date desc, id desc')
+        product_ids = set(products.ids)
+        index = {}
+        for agreement in agreements:
+            for agreement_line in agreement.line_ids:
+                if agreement_line.product_id.id in product_ids:
+                    index.setdefault(agreement_line.product_id.id, agreement.vendor_id.id)
+        return index
+
+    @api.model
+    def _index_history(self, products, company):
+        """Vendor of the latest confirmed purchase order line of each product"""
+        if not products:
+            return {}
+        self.env['purchase.order.line'].flush_model(['product_id', 'order_id', 'create_date'])
+        self.env['purchase.order'].flush_model(['partner_id', 'state', 'company_id'])
+        self.env.cr.execute("""
+            SELECT DISTINCT ON (line.product_id) line.product_id, po.partner_id
+              FROM purchase_order_line line
+              JOIN purchase_order po ON po.id = line.order_id
+             WHERE line.product_id IN %s
+               AND po.state IN ('purchase', 'done')
+               AND po.company_id IN %s
+          ORDER BY line.product_id, line.create_date DESC, line.id DESC
+        """, [tuple(products.ids), tuple(self.env.companies.ids)])
+        return dict(self.env.cr.fetchall())
+
+    @api.model
+    def _index_supplierinfo(self, products, company):
+        """Cheapest vendor of the product or of its template"""
+        # A variant specific record always belongs to the template of the variant
+        infos = self.env['product.supplierinfo'].search([
+            ('product_tmpl_id', 'in', products.product_tmpl_id.ids),
+            ('company_id', 'in', [company.id, False])
+        ], order='price')
+        product_ids_by_template = {}
+        for product in products:
+            product_ids_by_template.setdefault(product.product_tmpl_id.id, []).append(product.id)
+        index = {}
+        for info in infos:
+            for product_id in product_ids_by_template.get(info.product_tmpl_id.id, []):
+                index.setdefault(product_id, info.partner_id.id)
+        return index
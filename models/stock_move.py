@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, api
+
+
+class StockMove(models.Model):
+    _inherit = 'stock.move'
+
+    # Fields whose change affects the planned movement stored on quants
+    _SCM_FORECAST_FIELDS = {'state', 'product_id', 'product_uom_qty', 'date', 'location_id', 'location_dest_id'}
+
+    def _get_forecast_keys(self):
+        """Return the (product_id, location_id) pairs touched by the moves"""
+        keys = set()
+        for move in self:
+            keys.add((move.product_id.id, move.location_id.id))
+            keys.add((move.product_id.id, move.location_dest_id.id))
+        return keys
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        moves = super(StockMove, self).create(vals_list)
+        self.env['stock.quant']._enqueue_forecast_delta(moves._get_forecast_keys())
+        return moves
+
+    def write(self, vals):
+        if not self._SCM_FORECAST_FIELDS.intersection(vals):
+            return super(StockMove, self).write(vals)
+
+        keys = self._get_forecast_keys()
+        result = super(StockMove, self).write(vals)
+        keys |= self._get_forecast_keys()
+        self.env['stock.quant']._enqueue_forecast_delta(keys)
+        return result
+
+    def _action_done(self, cancel_backorder=False):
+        moves = super(StockMove, self)._action_done(cancel_backorder=cancel_backorder)
+        self.env['scm.consumption.daily']._add_moves(moves)
+        return moves
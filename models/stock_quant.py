@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*-
 
 from odoo import models, fields, api, _
+from odoo.osv import expression
+from odoo.tools import split_every
+from collections import defaultdict
 from datetime import datetime, timedelta
 
 
@@ -8,6 +11,16 @@ class StockQuantExtended(models.Model):
     _inherit = 'stock.quant'
     
     forecasted_qty = fields.Float('Forecasted Qty', compute='_compute_forecasted_qty', store=False)
+    forecast_delta_qty = fields.Float(
+        'Planned Net Movement',
+        readonly=True,
+        help="Scheduled inbound minus outbound moves and confirmed forecast demand over the next 30 days"
+    )
+    forecasted_qty_stored = fields.Float(
+        'Forecasted Qty (Stored)',
+        compute='_compute_forecasted_qty_stored',
+        store=True
+    )
     safety_stock_level = fields.Float('Safety Stock Level', compute='_compute_safety_stock')
     reorder_point = fields.Float('Reorder Point', compute='_compute_safety_stock')
     stock_status = fields.Selection([
@@ -15,71 +28,174 @@ class StockQuantExtended(models.Model):
         ('below_reorder', 'Below Reorder Point'),
         ('normal', 'Normal'),
         ('excess', 'Excess')
-    ], string='Stock Status', compute='_compute_stock_status', store=True)
+    ], string='Stock Status', readonly=True)
     days_of_stock = fields.Float('Days of Stock', compute='_compute_days_of_stock')
-    is_critical = fields.Boolean('Critical Shortage', compute='_compute_stock_status', store=True)
+    is_critical = fields.Boolean('Critical Shortage', readonly=True)
     
+    @api.model
+    def _get_forecast_deltas(self, product_ids, location_ids, days=30):
+        """Net planned movement per (product, location) over the next days.
+
+        Scheduled inbound moves minus scheduled outbound moves and confirmed
+        forecast demand, fetched with three grouped queries. Returns a dict
+        {(product_id, location_id): quantity}.
+        """
+        deltas = defaultdict(float)
+        if not product_ids or not location_ids:
+            return deltas
+
+        product_ids = list(product_ids)
+        location_ids = list(location_ids)
+        Move = self.env['stock.move']
+        scheduled_domain = [
+            ('product_id', 'in', product_ids),
+            ('state', 'in', ['assigned', 'partially_available']),
+            ('date', '<=', fields.Datetime.now() + timedelta(days=days)),
+        ]
+
+        # Scheduled inbound deliveries
+        for product, location, quantity in Move._read_group(
+            scheduled_domain + [('location_dest_id', 'in', location_ids)],
+            groupby=['product_id', 'location_dest_id'],
+            aggregates=['product_qty:sum'],
+        ):
+            deltas[(product.id, location.id)] += quantity
+
+        # Scheduled outbound deliveries
+        for product, location, quantity in Move._read_group(
+            scheduled_domain + [('location_id', 'in', location_ids)],
+            groupby=['product_id', 'location_id'],
+            aggregates=['product_qty:sum'],
+        ):
+            deltas[(product.id, location.id)] -= quantity
+
+        # Forecasted demand, attached to the stock location of the warehouse
+        for product, warehouse, quantity in self.env['scm.forecast.line']._read_group(
+            [
+                ('product_id', 'in', product_ids),
+                ('warehouse_id.lot_stock_id', 'in', location_ids),
+                ('date', '<=', fields.Date.today() + timedelta(days=days)),
+                ('state', '=', 'confirmed'),
+            ],
+            groupby=['product_id', 'warehouse_id'],
+            aggregates=['forecast_qty:sum'],
+        ):
+            deltas[(product.id, warehouse.lot_stock_id.id)] -= quantity
+
+        return deltas
+
     def _compute_forecasted_qty(self):
         """Compute forecasted quantity based on current stock and planned movements"""
+        deltas = self._get_forecast_deltas(set(self.product_id.ids), set(self.location_id.ids))
         for quant in self:
-            # Current quantity already in quant
-            current_qty = quant.quantity
-            
-            # Scheduled inbound deliveries (within next 30 days)
-            date_limit = fields.Datetime.now() + timedelta(days=30)
-            inbound_domain = [
-                ('product_id', '=', quant.product_id.id),
-                ('location_dest_id', '=', quant.location_id.id),
-                ('state', 'in', ['assigned', 'partially_available']),
-                ('date', '<=', date_limit)
-            ]
-            
-            inbound_moves = self.env['stock.move'].search(inbound_domain)
-            inbound_qty = sum(inbound_moves.mapped('product_qty')) if inbound_moves else 0
-            
-            # Scheduled outbound deliveries (within next 30 days)
-            outbound_domain = [
-                ('product_id', '=', quant.product_id.id),
-                ('location_id', '=', quant.location_id.id),
-                ('state', 'in', ['assigned', 'partially_available']),
-                ('date', '<=', date_limit)
-            ]
-            
-            outbound_moves = self.env['stock.move'].search(outbound_domain)
-            outbound_qty = sum(outbound_moves.mapped('product_qty')) if outbound_moves else 0
-            
-            # Forecasted demand from sales forecast
-            forecast_domain = [
-                ('product_id', '=', quant.product_id.id),
-                ('warehouse_id.lot_stock_id', '=', quant.location_id.id),
-                ('date', '<=', fields.Date.today() + timedelta(days=30)),
-                ('state', '=', 'confirmed')
-            ]
-            
-            forecasts = self.env['scm.forecast.line'].search(forecast_domain)
-            forecast_demand = sum(forecasts.mapped('forecast_qty')) if forecasts else 0
-            
-            # Final forecasted quantity
-            quant.forecasted_qty = current_qty + inbound_qty - outbound_qty - forecast_demand
-    
+            quant.forecasted_qty = quant.quantity + deltas.get((quant.product_id.id, quant.location_id.id), 0.0)
+
+    @api.depends('quantity', 'forecast_delta_qty')
+    def _compute_forecasted_qty_stored(self):
+        for quant in self:
+            quant.forecasted_qty_stored = quant.quantity + quant.forecast_delta_qty
+
+    @api.model
+    def _refresh_forecast_delta(self, keys):
+        """Update the stored planned movement of the quants of some keys.
+
+        ``keys`` is an iterable of (product_id, location_id) pairs whose moves
+        or forecasts changed. Quants sharing the same value are written together.
+        """
+        keys = {key for key in keys if all(key)}
+        if not keys:
+            return
+        product_ids = {product_id for product_id, location_id in keys}
+        location_ids = {location_id for product_id, location_id in keys}
+
+        quants = self.sudo().search([
+            ('product_id', 'in', list(product_ids)),
+            ('location_id', 'in', list(location_ids)),
+        ])
+        deltas = self._get_forecast_deltas(product_ids, location_ids)
+
+        quant_ids_by_delta = defaultdict(list)
+        for quant in quants:
+            key = (quant.product_id.id, quant.location_id.id)
+            if key in keys:
+                delta = deltas.get(key, 0.0)
+                if delta != quant.forecast_delta_qty:
+                    quant_ids_by_delta[delta].append(quant.id)
+        for delta, quant_ids in quant_ids_by_delta.items():
+            self.sudo().browse(quant_ids).write({'forecast_delta_qty': delta})
+
+    @api.model
+    def _enqueue_forecast_delta(self, keys):
+        """Queue (product_id, location_id) pairs whose planned movement is stale.
+
+        The queue is processed once, in batch, right before the transaction
+        commits, so a batch of moves or forecast lines triggers one refresh.
+        """
+        data = self.env.cr.precommit.data
+        queue = data.get('scm.forecast_delta.keys')
+        if queue is None:
+            queue = data['scm.forecast_delta.keys'] = set()
+            self.env.cr.precommit.add(self._process_forecast_delta_queue)
+        queue.update(key for key in keys if all(key))
+
+    @api.model
+    def _process_forecast_delta_queue(self):
+        """Refresh the planned movement of the quants of the queued keys"""
+        keys = self.env.cr.precommit.data.pop('scm.forecast_delta.keys', set())
+        if not keys:
+            return
+        self._refresh_forecast_delta(keys)
+        self.sudo().flush_model(['forecast_delta_qty', 'forecasted_qty_stored'])
+
+    @api.model
+    def _cron_refresh_forecast_delta(self, batch_size=1000):
+        """Rebuild the stored planned movement of all internal quants.
+
+        Runs daily since the 30-day window moves forward with time.
+        """
+        quant_ids = self.sudo().search([('location_id.usage', '=', 'internal')]).ids
+        for batch_ids in split_every(batch_size, quant_ids):
+            quants = self.sudo().browse(batch_ids)
+            self._refresh_forecast_delta({
+                (quant.product_id.id, quant.location_id.id) for quant in quants
+            })
+            quants.invalidate_recordset()
+
+    def _get_applicable_rules(self):
+        """Resolve the inventory rule of every quant in one pass.
+
+        Quants are grouped by the warehouse of their (internal) location and
+        their company, and resolved with the bulk rule lookup. Returns a dict {quant_id: rule}.
+        """
+        groups = {}
+        product_ids_by_group = {}
+        for quant in self:
+            warehouse = self.env['stock.warehouse']
+            if quant.location_id.usage == 'internal':
+                warehouse = quant.location_id.warehouse_id
+            group = (warehouse, quant.company_id)
+            groups[quant.id] = group
+            product_ids_by_group.setdefault(group, set()).add(quant.product_id.id)
+
+        rules_by_group = {
+            (warehouse, company): self.env['scm.inventory.rule'].get_applicable_rules(
+                self.env['product.product'].browse(product_ids), warehouse, company=company or None
+            )
+            for (warehouse, company), product_ids in product_ids_by_group.items()
+        }
+
+        rules = {}
+        for quant in self:
+            rules[quant.id] = rules_by_group[groups[quant.id]][quant.product_id.id]
+        return rules
+
     def _compute_safety_stock(self):
         """Compute safety stock levels based on inventory rules"""
-        inventory_rule_obj = self.env['scm.inventory.rule']
+        rules = self._get_applicable_rules()
         
         for quant in self:
-            warehouse = False
-            if quant.location_id.usage == 'internal':
-                warehouse = self.env['stock.warehouse'].search([
-                    ('lot_stock_id', '=', quant.location_id.id)
-                ], limit=1)
-                
-                if not warehouse:
-                    warehouse = self.env['stock.warehouse'].search([
-                        ('view_location_id', 'parent_of', quant.location_id.id)
-                    ], limit=1)
-            
             # Find applicable rule
-            rule = inventory_rule_obj.get_applicable_rule(quant.product_id, warehouse)
+            rule = rules[quant.id]
             
             if rule:
                 quant.safety_stock_level = rule.safety_stock_qty
@@ -88,43 +204,133 @@ class StockQuantExtended(models.Model):
                 quant.safety_stock_level = 0.0
                 quant.reorder_point = 0.0
     
-    @api.depends('quantity', 'safety_stock_level', 'reorder_point')
-    def _compute_stock_status(self):
-        """Determine stock status based on quantity and inventory rules"""
+    @api.model
+    def _get_stock_status(self, quantity, safety_stock_level, reorder_point):
+        """Return the (stock_status, is_critical) pair for the given levels"""
+        if quantity <= 0:
+            return 'below_safety', True
+        elif quantity < safety_stock_level:
+            return 'below_safety', True
+        elif quantity < reorder_point:
+            return 'below_reorder', False
+        elif quantity > reorder_point * 2:  # Simple definition of excess
+            return 'excess', False
+        return 'normal', False
+
+    def _recompute_stock_status(self):
+        """Determine stock status based on quantity and inventory rules.
+
+        Rules are resolved in bulk and quants ending up with the same status
+        are written together; unchanged quants are not written at all.
+        """
+        rules = self._get_applicable_rules()
+
+        quant_ids_by_status = defaultdict(list)
         for quant in self:
-            if quant.quantity <= 0:
-                quant.stock_status = 'below_safety'
-                quant.is_critical = True
-            elif quant.quantity < quant.safety_stock_level:
-                quant.stock_status = 'below_safety'
-                quant.is_critical = True
-            elif quant.quantity < quant.reorder_point:
-                quant.stock_status = 'below_reorder'
-                quant.is_critical = False
-            elif quant.quantity > quant.reorder_point * 2:  # Simple definition of excess
-                quant.stock_status = 'excess'
-                quant.is_critical = False
-            else:
-                quant.stock_status = 'normal'
-                quant.is_critical = False
-    
+            rule = rules[quant.id]
+            status = self._get_stock_status(
+                quant.quantity,
+                rule.safety_stock_qty if rule else 0.0,
+                rule.reorder_point if rule else 0.0,
+            )
+            if status != (quant.stock_status, quant.is_critical):
+                quant_ids_by_status[status].append(quant.id)
+
+        for (stock_status, is_critical), quant_ids in quant_ids_by_status.items():
+            self.browse(quant_ids).write({
+                'stock_status': stock_status,
+                'is_critical': is_critical,
+            })
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        quants = super(StockQuantExtended, self).create(vals_list)
+        self._enqueue_stock_status(quants._get_stock_status_keys())
+        return quants
+
+    def write(self, vals):
+        result = super(StockQuantExtended, self).write(vals)
+        if 'quantity' in vals:
+            self._enqueue_stock_status(self._get_stock_status_keys())
+        return result
+
+    def _get_stock_status_keys(self):
+        """Return the (product_id, warehouse_id) pairs of the internal quants.
+
+        Quants outside the warehouses (customers, vendors, inventory loss)
+        have no stock level to watch and are left out.
+        """
+        return {
+            (quant.product_id.id, quant.location_id.warehouse_id.id)
+            for quant in self
+            if quant.location_id.usage == 'internal' and quant.location_id.warehouse_id
+        }
+
+    @api.model
+    def _enqueue_stock_status(self, keys):
+        """Queue (product_id, warehouse_id) pairs whose stock status is stale.
+
+        A ``False`` warehouse stands for every warehouse of the product, which
+        only inventory rule changes ask for. The queue is processed once, in
+        batch, right before the transaction commits.
+        """
+        data = self.env.cr.precommit.data
+        queue = data.get('scm.stock_status.keys')
+        if queue is None:
+            queue = data['scm.stock_status.keys'] = set()
+            self.env.cr.precommit.add(self._process_stock_status_queue)
+        queue.update(key for key in keys if key[0])
+
+    @api.model
+    def _process_stock_status_queue(self):
+        """Recompute the stock status of the quants of the queued keys"""
+        keys = self.env.cr.precommit.data.pop('scm.stock_status.keys', set())
+        if not keys:
+            return
+        # One domain term per warehouse, and one for the rules of every warehouse
+        product_ids_by_warehouse = defaultdict(list)
+        for product_id, warehouse_id in keys:
+            product_ids_by_warehouse[warehouse_id].append(product_id)
+        domains = []
+        for warehouse_id, product_ids in product_ids_by_warehouse.items():
+            domain = [('product_id', 'in', product_ids)]
+            if warehouse_id:
+                domain.append(('location_id.warehouse_id', '=', warehouse_id))
+            domains.append(domain)
+        quants = self.sudo().search(expression.AND([
+            [('location_id.usage', '=', 'internal')], expression.OR(domains)
+        ]))
+        quants._recompute_stock_status()
+        quants.flush_recordset(['stock_status', 'is_critical'])
+
+    @api.model
+    def _rebuild_stock_status(self, batch_size=1000):
+        """Recompute the stock status of every internal quant.
+
+        Quants are streamed by id in chunks and the cache is cleared after
+        each chunk, so memory stays bounded whatever the number of quants.
+        """
+        Quant = self.sudo()
+        last_id = 0
+        while True:
+            quants = Quant.search(
+                [('id', '>', last_id), ('location_id.usage', '=', 'internal')], order='id', limit=batch_size
+            )
+            if not quants:
+                break
+            last_id = quants.ids[-1]
+            quants._recompute_stock_status()
+            self.env.flush_all()
+            self.env.invalidate_all()
+        return True
+
     def _compute_days_of_stock(self):
         """Calculate days of inventory based on average daily usage"""
+        rules = self._get_applicable_rules()
+
         for quant in self:
-            # Find applicable rule to get average daily usage
-            warehouse = False
-            if quant.location_id.usage == 'internal':
-                warehouse = self.env['stock.warehouse'].search([
-                    ('lot_stock_id', '=', quant.location_id.id)
-                ], limit=1)
-                
-                if not warehouse:
-                    warehouse = self.env['stock.warehouse'].search([
-                        ('view_location_id', 'parent_of', quant.location_id.id)
-                    ], limit=1)
-            
             # Get rule with avg_daily_usage
-            rule = self.env['scm.inventory.rule'].get_applicable_rule(quant.product_id, warehouse)
+            rule = rules[quant.id]
             
             if rule and rule.avg_daily_usage > 0:
                 quant.days_of_stock = quant.quantity / rule.avg_daily_usage
@@ -147,7 +353,9 @@ class StockQuantExtended(models.Model):
                     ('view_location_id', 'parent_of', self.location_id.id)
                 ], limit=1)
         
-        rule = self.env['scm.inventory.rule'].get_applicable_rule(self.product_id, warehouse)
+        rule = self.env['scm.inventory.rule'].get_applicable_rule(
+            self.product_id, warehouse, company=self.company_id or None
+        )
         
         if not rule:
             return {
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""Benchmark of the consolidation to purchase order pipeline.
+
+Excluded from the default test runs, run it explicitly on a test database::
+
+    odoo-bin -d bench -i scm_procurement --test-tags scm_benchmark --stop-after-init
+
+Set ``SCM_BENCHMARK_OUTPUT`` to write the results as JSON, and
+``SCM_BENCHMARK_BASELINE`` to the results of a previous run to fail on
+stages slower or more query-intensive than the baseline by more than
+``SCM_BENCHMARK_TOLERANCE`` (1.2 by default).
+"""
+
+from odoo import fields
+from odoo.tests import TransactionCase, tagged
+from datetime import timedelta
+import json
+import logging
+import os
+import random
+import time
+import tracemalloc
+
+_logger = logging.getLogger(__name__)
+
+# Dataset sizes: purchase requests x lines per request, products,
+# warehouses and done consumption moves per product
+SIZES = {
+    'small': {'requests': 10, 'lines': 10, 'products': 50, 'warehouses': 1, 'moves': 5},
+    'medium': {'requests': 50, 'lines': 20, 'products': 500, 'warehouses': 2, 'moves': 10},
+    'large': {'requests': 200, 'lines': 50, 'products': 5000, 'warehouses': 3, 'moves': 20},
+}
+
+
+@tagged('-at_install', '-post_install', 'scm_benchmark')
+class TestScmBenchmark(TransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super(TestScmBenchmark, cls).setUpClass()
+        cls.results = {
+            'date': fields.Datetime.to_string(fields.Datetime.now()),
+            'runs': [],
+        }
+        cls.baseline = {}
+        baseline_path = os.environ.get('SCM_BENCHMARK_BASELINE')
+        if baseline_path:
+            with open(baseline_path) as baseline_file:
+                cls.baseline = {run['size']: run for run in json.load(baseline_file).get('runs', [])}
+        cls.tolerance = float(os.environ.get('SCM_BENCHMARK_TOLERANCE', 1.2))
+
+    @classmethod
+    def tearDownClass(cls):
+        output_path = os.environ.get('SCM_BENCHMARK_OUTPUT')
+        if output_path:
+            with open(output_path, 'w') as output_file:
+                json.dump(cls.results, output_file, indent=2)
+            _logger.info("Benchmark results written to %s", output_path)
+        super(TestScmBenchmark, cls).tearDownClass()
+
+    def test_benchmark_small(self):
+        self._run_size('small')
+
+    def test_benchmark_medium(self):
+        self._run_size('medium')
+
+    def test_benchmark_large(self):
+        self._run_size('large')
+
+    def _run_size(self, name):
+        """Generate one dataset, measure the stages and compare with the baseline"""
+        random.seed(42)
+        size = SIZES[name]
+        # Keep every stage synchronous, whatever the dataset size
+        self.env['ir.config_parameter'].sudo().set_param('scm_procurement.async_line_threshold', 10 ** 9)
+        data = self._generate_dataset(size)
+        session = data['session']
+        stages = {}
+
+        stages['action_start_consolidation'] = self._measure(session.action_start_consolidation)
+
+        wizard = self.env['select.pr.lines.wizard'].with_context(active_id=session.id).create({
+            'session_id': session.id,
+            'line_ids': [(6, 0, data['pr_lines'].ids)],
+        })
+        stages['action_consolidate_selected_lines'] = self._measure(wizard.action_consolidate_selected_lines)
+
+        stages['action_check_inventory_all'] = self._measure(session.action_check_inventory_all)
+
+        Validate = self.env['validate.inventory.wizard'].with_context(
+            active_id=session.id, active_model=session._name
+        )
+        stages['validate_inventory_default_get'] = self._measure(
+            lambda: Validate.default_get(list(Validate._fields))
+        )
+
+        # The wizard lines require a vendor, taken from the suggested one
+        session.consolidated_line_ids.action_suggest_vendors()
+        session.consolidated_line_ids.filtered(lambda l: not l.suggested_vendor_id).write({
+            'suggested_vendor_id': data['vendor'].id,
+        })
+        po_wizard = self.env['scm.create.po.wizard'].with_context(
+            active_id=session.id, active_model=session._name
+        ).create({'consolidation_id': session.id})
+        stages['action_create_pos'] = self._measure(po_wizard.action_create_pos)
+
+        for stage, metrics in stages.items():
+            _logger.info(
+                "Benchmark %s / %s: %.3fs, %d queries, %d KiB peak",
+                name, stage, metrics['wall_time'], metrics['query_count'], metrics['peak_memory_kb'],
+            )
+        self.results['runs'].append({'size': name, 'stages': stages})
+        self._check_regressions(name, stages)
+
+    def _measure(self, func):
+        """Run a stage and return its wall time, query count and peak memory"""
+        cr = self.env.cr
+        self.env.flush_all()
+        self.env.invalidate_all()
+        tracemalloc.start()
+        query_count = cr.sql_log_count
+        start = time.perf_counter()
+        try:
+            func()
+            self.env.flush_all()
+            wall_time = time.perf_counter() - start
+            peak_memory = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        return {
+            'wall_time': round(wall_time, 4),
+            'query_count': cr.sql_log_count - query_count,
+            'peak_memory_kb': peak_memory // 1024,
+        }
+
+    def _check_regressions(self, name, stages):
+        """Fail on the stages slower or more query-intensive than the baseline"""
+        baseline_run = self.baseline.get(name)
+        if not baseline_run:
+            return
+        for stage, metrics in stages.items():
+            reference = baseline_run['stages'].get(stage)
+            if not reference:
+                continue
+            for metric in ('wall_time', 'query_count'):
+                with self.subTest(size=name, stage=stage, metric=metric):
+                    if reference[metric]:
+                        self.assertLessEqual(
+                            metrics[metric], reference[metric] * self.tolerance,
+                            "%s of %s went from %s to %s" % (metric, stage, reference[metric], metrics[metric]),
+                        )
+
+    def _generate_dataset(self, size):
+        """Create the records of a synthetic dataset"""
+        env = self.env
+        today = fields.Date.today()
+        tag = 'BENCH%s' % random.randint(0, 10 ** 6)
+
+        warehouses = env['stock.warehouse'].create([{
+            'name': '%s Warehouse %s' % (tag, index),
+            'code': 'B%s%s' % (index, random.randint(0, 99)),
+        } for index in range(size['warehouses'])])
+
+        vendor = env['res.partner'].create({'name': '%s Vendor' % tag, 'supplier_rank': 1})
+        products = env['product.product'].create([{
+            'name': '%s Product %s' % (tag, index),
+            'detailed_type': 'product',
+            'standard_price': random.uniform(1, 100),
+            'seller_ids': [(0, 0, {'partner_id': vendor.id, 'price': random.uniform(1, 100)})],
+        } for index in range(size['products'])])
+
+        self._generate_move_history(products, warehouses, size['moves'])
+
+        requests = env['purchase.request'].create([{
+            'requester_id': env.user.id,
+            'department': 'Benchmark',
+        } for index in range(size['requests'])])
+        pr_lines = env['purchase.request.line'].create([{
+            'request_id': request.id,
+            'product_id': product.id,
+            'product_qty': random.randint(1, 100),
+            'product_uom_id': product.uom_id.id,
+            'date_required': today + timedelta(days=random.randint(0, 29)),
+        } for request in requests for product in random.sample(list(products), min(size['lines'], len(products)))])
+        requests.write({'state': 'approved'})
+
+        session = env['scm.pr.consolidation.session'].create({
+            'date_from': today,
+            'date_to': today + timedelta(days=30),
+            'warehouse_id': warehouses[0].id,
+        })
+        env.flush_all()
+        return {'session': session, 'pr_lines': pr_lines, 'vendor': vendor}
+
+    def _generate_move_history(self, products, warehouses, moves_per_product):
+        """Create done deliveries spread over the last 90 days"""
+        customer_location = self.env.ref('stock.stock_location_customers')
+        moves = self.env['stock.move'].create([{
+            'name': 'Benchmark consumption',
+            'product_id': product.id,
+            'product_uom': product.uom_id.id,
+            'product_uom_qty': random.randint(1, 20),
+            'location_id': random.choice(warehouses).lot_stock_id.id,
+            'location_dest_id': customer_location.id,
+        } for product in products for index in range(moves_per_product)])
+        moves._action_confirm()
+        for move in moves:
+            move.write({'quantity': move.product_uom_qty, 'picked': True})
+        moves._action_done()
+
+        # Spread the history and rebuild the consumption table accordingly
+        now = fields.Datetime.now()
+        for move in moves:
+            move.date = now - timedelta(days=random.randint(0, 89))
+        self.env['scm.consumption.daily']._rebuild()
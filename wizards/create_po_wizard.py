@@ -95,30 +95,26 @@ class CreatePOWizard(models.TransientModel):
         """Auto-assign vendors and agreements to lines based on purchase history and active agreements."""
         self.ensure_one()
         
-        for line in self.line_ids:
-            if line.vendor_id:
-                continue  # Skip if vendor already assigned
-                
-            # First try to find a vendor from active agreements
-            agreements = self.env['purchase.requisition'].search([
-                ('state', 'in', ['ongoing', 'open']),
-                ('line_ids.product_id', '=', line.product_id.id)
-            ])
-            
-            if agreements:
-                # Take the most recent agreement's vendor
-                latest_agreement = agreements.sorted(lambda a: a.create_date, reverse=True)[0]
-                line.vendor_id = latest_agreement.vendor_id.id
-                continue
-            
-            # If no agreement found, try to find from purchase history
-            purchase_lines = self.env['purchase.order.line'].search([
-                ('product_id', '=', line.product_id.id),
-                ('order_id.state', 'in', ['purchase', 'done'])
-            ], order='create_date desc', limit=1)
-            
-            if purchase_lines:
-                line.vendor_id = purchase_lines.order_id.partner_id.id
+        lines = self.line_ids.filtered(lambda l: not l.vendor_id)  # Skip if vendor already assigned
+        
+        # Resolve the vendors of all the products at once: active agreements first,
+        # then purchase history
+        vendors = self.env['scm.vendor.index'].get_vendors(
+            lines.mapped('product_id'), sources=('agreement', 'history')
+        )
+        
+        lines_by_vendor = {}
+        for line in lines:
+            vendor = vendors.get(line.product_id.id)
+            if vendor:
+                lines_by_vendor.setdefault(vendor, self.env['scm.create.po.wizard.line'])
+                lines_by_vendor[vendor] |= line
+        assigned_lines = self.env['scm.create.po.wizard.line']
+        for vendor, vendor_lines in lines_by_vendor.items():
+            vendor_lines.write({'vendor_id': vendor.id})
+            assigned_lines |= vendor_lines
+        # Price all the assigned lines from a single matrix load
+        assigned_lines._apply_vendor_prices()
 
         return {'type': 'ir.actions.act_window_close'}
 
@@ -129,59 +125,70 @@ class CreatePOWizard(models.TransientModel):
         if not all(line.vendor_id for line in self.line_ids):
             raise UserError(_("Please assign vendors to all lines before creating purchase orders."))
         
-        # Group lines by vendor
-        lines_by_vendor = {}
-        for line in self.line_ids:
-            if line.vendor_id not in lines_by_vendor:
-                lines_by_vendor[line.vendor_id] = []
-            lines_by_vendor[line.vendor_id].append(line)
+        with self.env['scm.perf.trace']._trace(self.consolidation_id, 'po_creation') as trace:
+            # Group lines by vendor
+            lines_by_vendor = {}
+            for line in self.line_ids:
+                if line.vendor_id not in lines_by_vendor:
+                    lines_by_vendor[line.vendor_id] = []
+                lines_by_vendor[line.vendor_id].append(line)
         
-        # Create PO for each vendor
-        created_pos = self.env['purchase.order']
-        for vendor, lines in lines_by_vendor.items():
-            po_vals = {
-                'partner_id': vendor.id,
-                'date_order': self.date_order,
-                'currency_id': self.currency_id.id,
-                'origin': self.consolidation_id.name,
-                'consolidation_id': self.consolidation_id.id,  # Link to consolidation
-                'order_line': [],
-            }
-            
-            for line in lines:
-                po_line_vals = {
-                    'product_id': line.product_id.id,
-                    'name': line.product_id.display_name,
-                    'product_uom_qty': line.quantity_to_purchase,
-                    'product_uom': line.product_uom_id.id,
-                    'price_unit': line.price_unit,
-                    'date_planned': self.date_order,
+            # Build the values of all the POs, one per vendor
+            po_vals_list = []
+            for vendor, lines in lines_by_vendor.items():
+                po_vals = {
+                    'partner_id': vendor.id,
+                    'date_order': self.date_order,
+                    'currency_id': self.currency_id.id,
+                    'origin': self.consolidation_id.name,
+                    'consolidation_id': self.consolidation_id.id,  # Link to consolidation
+                    'order_line': [],
                 }
+            
+                for line in lines:
+                    po_line_vals = {
+                        'product_id': line.product_id.id,
+                        'name': line.product_id.display_name,
+                        'product_uom_qty': line.quantity_to_purchase,
+                        'product_uom': line.product_uom_id.id,
+                        'price_unit': line.price_unit,
+                        'date_planned': self.date_order,
+                    }
                 
-                if line.agreement_id:
-                    po_vals['requisition_id'] = line.agreement_id.id
-                    agreement_line = line.agreement_id.line_ids.filtered(
-                        lambda l: l.product_id == line.product_id
-                    )
-                    if agreement_line:
-                        po_line_vals['price_unit'] = agreement_line[0].price_unit
+                    if line.agreement_id:
+                        po_vals['requisition_id'] = line.agreement_id.id
+                        agreement_line = line.agreement_id.line_ids.filtered(
+                            lambda l: l.product_id == line.product_id
+                        )
+                        if agreement_line:
+                            po_line_vals['price_unit'] = agreement_line[0].price_unit
                 
-                po_vals['order_line'].append((0, 0, po_line_vals))
+                    po_vals['order_line'].append((0, 0, po_line_vals))
+                po_vals_list.append(po_vals)
             
-            po = self.env['purchase.order'].create(po_vals)
-            created_pos |= po
+            # Create all the POs at once
+            created_pos = self.env['purchase.order'].create(po_vals_list)
             
-            # Update consolidation lines with the created PO
-            for line in lines:
-                po_line = po.order_line.filtered(
-                    lambda l: l.product_id == line.product_id
-                )
-                if po_line:
-                    line.consolidated_line_id.write({
-                        'purchase_order_id': po.id,
-                        'purchase_line_id': po_line.id,
-                        'state': 'po_created'
-                    })
+            # Map the PO lines back to the wizard lines: they are created in the same order
+            line_commands = []
+            for po, lines in zip(created_pos, lines_by_vendor.values()):
+                for line, po_line in zip(lines, po.order_line.sorted('id')):
+                    if line.consolidated_line_id:
+                        line_commands.append((1, line.consolidated_line_id.id, {
+                            'purchase_order_id': po.id,
+                            'purchase_line_id': po_line.id,
+                            'state': 'po_created',
+                        }))
+            
+            # Update consolidation lines with the created POs in a single write,
+            # then the fulfillment of their purchase request lines at once
+            if line_commands:
+                self.consolidation_id.with_context(scm_defer_fulfillment=True).write({
+                    'consolidated_line_ids': line_commands
+                })
+                self.line_ids.mapped('consolidated_line_id.purchase_request_line_ids')._update_fulfillment_status()
+        
+            trace['records'] = len(self.line_ids)
         
         # Update consolidation state to po_created
         self.consolidation_id.write({
@@ -242,8 +249,33 @@ class CreatePOWizardLine(models.TransientModel):
         store=True
     )
     
+    @api.model
+    def _get_agreement_lines_by_product(self, products):
+        """Return the agreement lines still valid today for the products.
+
+        The lines are loaded with a single query and returned as a dict
+        {product_id: requisition lines}, in agreement line order.
+        """
+        today = fields.Date.today()
+        requisition_lines = self.env['purchase.requisition.line'].search([
+            ('product_id', 'in', products.ids),
+            '|',
+            ('requisition_id.date_end', '=', False),
+            ('requisition_id.date_end', '>=', today),
+        ])
+        lines_by_product = {}
+        for requisition_line in requisition_lines:
+            lines_by_product.setdefault(requisition_line.product_id.id, []).append(requisition_line)
+        return lines_by_product
+
     @api.depends('product_id', 'vendor_id')
     def _compute_suggested_agreements(self):
+        # First find all agreements that have the products in their lines, for all the lines at once
+        products = self.mapped('product_id')
+        lines_by_product = self._get_agreement_lines_by_product(products)
+        _logger.info("Found valid agreement lines for %d of %d products", len(lines_by_product), len(products))
+
+        Requisition = self.env['purchase.requisition']
         for line in self:
             if not line.product_id:
                 line.suggested_agreement_ids = False
@@ -251,38 +283,25 @@ class CreatePOWizardLine(models.TransientModel):
                 line.has_agreements = False
                 continue
 
-            _logger.info(f'Finding agreements for product: {line.product_id.display_name}')
-
-            # First find all agreements that have this product in their lines
-            domain = [
-                ('product_id', '=', line.product_id.id),
-            ]
-            
-            # Add condition for end date: either no end date or end date >= today
-            today = fields.Date.today()
-            domain.append('|')
-            domain.append(('requisition_id.date_end', '=', False))
-            domain.append(('requisition_id.date_end', '>=', today))
-            
-            requisition_lines = self.env['purchase.requisition.line'].search(domain)
-            agreements = requisition_lines.mapped('requisition_id')
+            requisition_lines = lines_by_product.get(line.product_id.id, [])
             
             # If vendor is selected, filter agreements by vendor
             if line.vendor_id:
-                agreements = agreements.filtered(lambda a: a.vendor_id == line.vendor_id)
-            
-            _logger.info(f'Found {len(agreements)} valid agreements for product {line.product_id.display_name}')
-            if agreements:
-                _logger.info(f'Agreement vendors: {agreements.mapped("vendor_id.name")}')
+                requisition_lines = [rl for rl in requisition_lines if rl.requisition_id.vendor_id == line.vendor_id]
+            agreements = Requisition.browse(list(dict.fromkeys(rl.requisition_id.id for rl in requisition_lines)))
             
             line.suggested_agreement_ids = agreements
             line.agreement_count = len(agreements)
             line.has_agreements = bool(agreements)
             
             # If there's only one agreement and no agreement selected yet, select it
+            # with its matching line and price
             if len(agreements) == 1 and not line.agreement_id:
                 line.agreement_id = agreements.id
-                line._onchange_agreement_id()
+                if not line.vendor_id:
+                    line.vendor_id = agreements.vendor_id.id
+                line.requisition_line_id = requisition_lines[0].id
+                line.price_unit = requisition_lines[0].price_unit
     
     @api.onchange('agreement_id')
     def _onchange_agreement_id(self):
@@ -293,10 +312,9 @@ class CreatePOWizardLine(models.TransientModel):
             
             if self.product_id:
                 # Find matching line in the agreement
-                requisition_line = self.env['purchase.requisition.line'].search([
-                    ('requisition_id', '=', self.agreement_id.id),
-                    ('product_id', '=', self.product_id.id)
-                ], limit=1)
+                requisition_line = self.agreement_id.line_ids.filtered(
+                    lambda l: l.product_id == self.product_id
+                ).sorted('id')[:1]
                 
                 if requisition_line:
                     self.requisition_line_id = requisition_line.id
@@ -306,11 +324,29 @@ class CreatePOWizardLine(models.TransientModel):
         else:
             self.requisition_line_id = False
     
+    def _apply_vendor_prices(self):
+        """Set the unit price from the price list of the vendor, for the lines
+        not priced by an agreement"""
+        lines = self.filtered(lambda l: l.vendor_id and l.product_id and not l.requisition_line_id)
+        if not lines:
+            return
+        PriceMatrix = self.env['scm.price.matrix']
+        matrix = PriceMatrix.get_matrix(lines.mapped('product_id'))
+        for line in lines:
+            date_order = line.wizard_id.date_order
+            entry = PriceMatrix.best_price(
+                matrix, line.product_id, line.quantity_to_purchase,
+                date_order.date() if date_order else None, line.vendor_id
+            )
+            if entry:
+                line.price_unit = entry['price']
+    
     @api.onchange('vendor_id')
     def _onchange_vendor_id(self):
         if self.vendor_id:
             # Recompute suggested agreements when vendor changes
             self._compute_suggested_agreements()
+            self._apply_vendor_prices()
             
             # Clear agreement if vendor doesn't match
             if self.agreement_id and self.agreement_id.vendor_id != self.vendor_id:
@@ -40,8 +40,22 @@ class ForecastWizard(models.TransientModel):
         ('180', 'Last 180 Days'),
         ('365', 'Last Year')
     ], string='Historical Period', default='90')
+    product_count = fields.Integer('Products to Forecast', compute='_compute_product_count')
     
-    @api.onchange('product_ids', 'warehouse_id', 'forecasting_method')
+    @api.depends('product_ids', 'category_id')
+    def _compute_product_count(self):
+        for wizard in self:
+            if wizard.product_ids:
+                wizard.product_count = len(wizard.product_ids)
+            elif wizard.category_id:
+                wizard.product_count = self.env['product.product'].search_count(
+                    wizard._get_category_products_domain()
+                )
+            else:
+                wizard.product_count = 0
+    
+    @api.onchange('product_ids', 'category_id', 'warehouse_id', 'forecasting_method',
+                  'forecast_period', 'historical_period')
     def _onchange_products(self):
         """Generate forecast lines based on selected products"""
         self.ensure_one()
@@ -49,38 +63,65 @@ class ForecastWizard(models.TransientModel):
         # Clear existing lines
         self.line_ids = [(5, 0, 0)]
         
+        # The products of a whole category are only counted here, their
+        # forecasts are computed on the server when the wizard is confirmed
         if not self.product_ids or not self.warehouse_id:
             return
         
-        forecast_lines = []
+        self.line_ids = [(0, 0, vals) for vals in self._prepare_line_vals(self.product_ids)]
+    
+    def _prepare_line_vals(self, products):
+        """Return the forecast line values of the products"""
+        self.ensure_one()
+        # Historical consumption of all the products in one query
+        if self.forecasting_method == 'historical':
+            consumption = self._get_historical_consumption(products)
         
-        for product in self.product_ids:
+        vals_list = []
+        for product in products:
             # Calculate forecast quantity based on method
             if self.forecasting_method == 'historical':
-                forecast_qty = self._calculate_from_historical(product)
+                forecast_qty = self._calculate_from_historical(product, consumption)
             else:
                 forecast_qty = 0.0
             
-            # Create forecast line
-            line_vals = {
-                'wizard_id': self.id,
+            vals_list.append({
                 'product_id': product.id,
                 'warehouse_id': self.warehouse_id.id,
                 'forecast_qty': forecast_qty,
                 'uom_id': product.uom_id.id,
-            }
-            forecast_lines.append((0, 0, line_vals))
-        
-        self.line_ids = forecast_lines
+            })
+        return vals_list
+    
+    def _get_category_products_domain(self):
+        return [('categ_id', 'child_of', self.category_id.id), ('type', 'in', ['product', 'consu'])]
+    
+    def _get_forecast_products(self):
+        """Return the selected products, or all the stockable products of the
+        category and its children when no product is selected"""
+        self.ensure_one()
+        if self.product_ids:
+            return self.product_ids
+        if self.category_id:
+            return self.env['product.product'].search(self._get_category_products_domain())
+        return self.env['product.product']
     
     @api.onchange('category_id')
     def _onchange_category(self):
         """Filter products by category"""
         if self.category_id:
-            domain = [('categ_id', 'child_of', self.category_id.id), ('type', 'in', ['product', 'consu'])]
-            return {'domain': {'product_ids': domain}}
+            return {'domain': {'product_ids': self._get_category_products_domain()}}
     
-    def _calculate_from_historical(self, product):
+    def _get_historical_consumption(self, products):
+        """Return the consumption of the products over the historical period"""
+        self.ensure_one()
+        if not self.warehouse_id:
+            return dict.fromkeys(products.ids, 0.0)
+        # Default to 90 days if not specified
+        days = int(self.historical_period) if self.historical_period else 90
+        return self.env['scm.consumption.daily'].get_consumption(products, self.warehouse_id, days=days)
+
+    def _calculate_from_historical(self, product, consumption=None):
         """Calculate forecast based on historical usage"""
         self.ensure_one()
         
@@ -89,25 +130,16 @@ class ForecastWizard(models.TransientModel):
         
         # Default to 90 days if not specified
         days = int(self.historical_period) if self.historical_period else 90
-        date_from = fields.Date.today() - fields.Relativedelta(days=days)
         
-        # Get stock moves (outgoing) for this product
-        domain = [
-            ('product_id', '=', product.id),
-            ('state', '=', 'done'),
-            ('date', '>=', date_from),
-            ('location_id.warehouse_id', '=', self.warehouse_id.id),
-            ('location_dest_id.usage', 'in', ['customer', 'production'])
-        ]
+        if consumption is None:
+            consumption = self._get_historical_consumption(product)
         
-        moves = self.env['stock.move'].search(domain)
+        # Calculate total quantity
+        total_qty = consumption.get(product.id, 0.0)
         
-        if not moves:
+        if not total_qty:
             return 0.0
         
-        # Calculate total quantity
-        total_qty = sum(moves.mapped('product_qty'))
-        
         # Convert to forecast period
         avg_daily = total_qty / days
         
@@ -126,45 +158,50 @@ class ForecastWizard(models.TransientModel):
         """Create forecasts from wizard data"""
         self.ensure_one()
         
-        if not self.line_ids:
-            raise UserError(_("No forecast lines to process."))
-        
-        forecast_obj = self.env['scm.forecast']
-        forecasts_created = []
-        
-        for line in self.line_ids:
-            if line.forecast_qty <= 0:
-                continue
-                
-            # Create forecast
-            forecast_vals = {
+        if self.line_ids:
+            line_vals = [{
                 'product_id': line.product_id.id,
                 'warehouse_id': line.warehouse_id.id,
-                'date': self.start_date,
-                'forecast_period': self.forecast_period,
                 'forecast_qty': line.forecast_qty,
                 'notes': line.notes,
-                'state': 'draft',
-            }
-            
-            forecast = forecast_obj.create(forecast_vals)
-            forecasts_created.append(forecast.id)
-            
-            # Generate forecast lines
-            forecast.generate_forecast_lines()
-            
-            # Copy from template if selected
-            if self.forecasting_method == 'template' and self.template_id:
+            } for line in self.line_ids]
+        elif self.warehouse_id:
+            # Whole category: resolve the products and their quantities here
+            line_vals = self._prepare_line_vals(self._get_forecast_products())
+        else:
+            line_vals = []
+        if not line_vals:
+            raise UserError(_("No forecast lines to process."))
+        
+        forecast_vals_list = [{
+            'product_id': vals['product_id'],
+            'warehouse_id': vals['warehouse_id'],
+            'date': self.start_date,
+            'forecast_period': self.forecast_period,
+            'forecast_qty': vals['forecast_qty'],
+            'notes': vals.get('notes'),
+            'state': 'draft',
+        } for vals in line_vals if vals['forecast_qty'] > 0]
+        
+        # Create all the forecasts at once
+        forecasts = self.env['scm.forecast'].create(forecast_vals_list)
+        
+        if self.forecasting_method == 'template' and self.template_id:
+            # Copy from template
+            for forecast in forecasts:
                 forecast.copy_from_template(self.template_id.id)
+        else:
+            # Generate the forecast lines of all the forecasts in one pass
+            forecasts._generate_forecast_lines_batch()
         
-        if forecasts_created:
+        if forecasts:
             # Show created forecasts
             return {
                 'name': _('Created Forecasts'),
                 'type': 'ir.actions.act_window',
                 'res_model': 'scm.forecast',
                 'view_mode': 'tree,form',
-                'domain': [('id', 'in', forecasts_created)],
+                'domain': [('id', 'in', forecasts.ids)],
             }
         else:
             return {'type': 'ir.actions.act_window_close'}
@@ -185,13 +222,20 @@ class ForecastWizardLine(models.TransientModel):
     @api.depends('product_id', 'warehouse_id')
     def _compute_stock_info(self):
         """Compute current stock information"""
+        # Stock of all the products in one grouped query
+        lines = self.filtered(lambda l: l.product_id and l.warehouse_id)
+        stock = {}
+        if lines:
+            stock = {
+                (product.id, location.id): quantity
+                for product, location, quantity in self.env['stock.quant']._read_group(
+                    [
+                        ('product_id', 'in', lines.mapped('product_id').ids),
+                        ('location_id', 'in', lines.mapped('warehouse_id.lot_stock_id').ids),
+                    ],
+                    groupby=['product_id', 'location_id'],
+                    aggregates=['quantity:sum'],
+                )
+            }
         for line in self:
-            if line.product_id and line.warehouse_id:
-                stock_quant = self.env['stock.quant'].search([
-                    ('product_id', '=', line.product_id.id),
-                    ('location_id', '=', line.warehouse_id.lot_stock_id.id)
-                ])
-                
-                line.current_stock = sum(stock_quant.mapped('quantity')) if stock_quant else 0.0
-            else:
-                line.current_stock = 0.0
\ No newline at end of file
+            line.current_stock = stock.get((line.product_id.id, line.warehouse_id.lot_stock_id.id), 0.0)
\ No newline at end of file
@@ -90,47 +90,16 @@ class SelectPRLinesWizard(models.TransientModel):
         if not self.line_ids:
             raise UserError(_("Please select at least one line to consolidate."))
         
-        # Group lines by product
-        product_lines = {}
-        for line in self.line_ids:
-            if line.product_id.id not in product_lines:
-                product_lines[line.product_id.id] = {
-                    'product_id': line.product_id.id,
-                    'product_uom_id': line.product_uom_id.id,
-                    'lines': [],
-                    'total_quantity': 0.0
-                }
-            product_lines[line.product_id.id]['lines'].append(line)
-            product_lines[line.product_id.id]['total_quantity'] += line.product_qty
-        
-        # Create or update consolidated lines
-        for product_id, data in product_lines.items():
-            # Check if consolidated line already exists
-            existing_line = self.env['scm.consolidated.pr.line'].search([
-                ('consolidation_id', '=', self.session_id.id),
-                ('product_id', '=', product_id)
-            ], limit=1)
-            
-            if existing_line:
-                # Update existing line
-                existing_line.write({
-                    'purchase_request_line_ids': [(6, 0, [line.id for line in data['lines']])],
-                    'total_quantity': data['total_quantity']
-                })
-            else:
-                # Create new line
-                self.env['scm.consolidated.pr.line'].create({
-                    'consolidation_id': self.session_id.id,
-                    'product_id': product_id,
-                    'product_uom_id': data['product_uom_id'],
-                    'total_quantity': data['total_quantity'],
-                    'purchase_request_line_ids': [(6, 0, [line.id for line in data['lines']])]
-                })
+        # Large selections are consolidated by a background job
+        if len(self.line_ids) > self.session_id._get_async_threshold():
+            return self.session_id._enqueue_job('consolidate', pr_lines=self.line_ids)
+
+        # Group and consolidate the lines in batch on the session
+        self.session_id._process_pr_lines_safely(self.line_ids)
         
         # Update session state to in_progress after consolidating lines
-        self.session_id.write({
-            'state': 'in_progress',
-            'purchase_request_ids': [(6, 0, self.line_ids.mapped('request_id').ids)]
-        })
+        self.session_id.write({'state': 'in_progress'})
+        # Link the requests of the new lines without dropping earlier ones
+        self.session_id._sync_purchase_requests()
         
         return {'type': 'ir.actions.act_window_close'} 
\ No newline at end of file
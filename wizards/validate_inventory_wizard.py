@@ -6,6 +6,8 @@ import logging
 
 _logger = logging.getLogger(__name__)
 
+INVENTORY_DATA_KEY = 'scm_procurement.validate_inventory_data'
+
 
 class ValidateInventoryWizard(models.TransientModel):
     _name = 'validate.inventory.wizard'
@@ -53,26 +55,17 @@ class ValidateInventoryWizard(models.TransientModel):
         else:
             session = self.session_id
             if session and session.consolidated_line_ids:
+                data = self._load_inventory_data(self.session_id)
                 wizard_line_vals = []
                 for line in session.consolidated_line_ids:
-                    # Get inventory levels
-                    available_qty = line.product_id.with_context(
-                        location=session.warehouse_id.lot_stock_id.id
-                    ).qty_available
-                    
-                    # Get inventory rule
-                    rule = self.env['scm.inventory.rule'].get_applicable_rule(
-                        line.product_id, 
-                        session.warehouse_id
-                    )
-                    
+                    values = data.get(line.product_id.id, {})
                     wizard_line_vals.append((0, 0, {
                         'product_id': line.product_id.id,
                         'product_uom_id': line.product_uom_id.id,
                         'consolidated_line_id': line.id,
-                        'available_qty': available_qty,
-                        'safety_stock_qty': rule.safety_stock_qty if rule else 0.0,
-                        'reorder_point': rule.reorder_point if rule else 0.0,
+                        'available_qty': values.get('onhand', 0.0),
+                        'safety_stock_qty': values.get('safety_stock_qty', 0.0),
+                        'reorder_point': values.get('reorder_point', 0.0),
                     }))
                 
                 self.line_ids = [(5, 0, 0)] + wizard_line_vals
@@ -80,42 +73,72 @@ class ValidateInventoryWizard(models.TransientModel):
     @api.onchange('session_id')
     def _onchange_session_id(self):
         """Update stock values when session changes according to FR-SCM-004"""
-        if self.session_id and self.line_ids:
+        if self.session_id and self.line_ids and self.session_id.warehouse_id.lot_stock_id:
+            data = self._load_inventory_data(self.session_id)
             for line in self.line_ids:
-                if line.product_id:
-                    # Get the stock location for the session
-                    stock_location = self.session_id.warehouse_id.lot_stock_id
-                    if stock_location:
-                        # Get current stock (actual on-hand quantity) from the specific session
-                        current_stock = line.product_id.with_context(
-                            location=stock_location.id
-                        ).qty_available
-                        
-                        # Get inventory rule parameters for the product in this session
-                        rule = self.env['scm.inventory.rule'].get_applicable_rule(
-                            line.product_id, 
-                            self.session_id.warehouse_id
-                        )
-                        
-                        # Calculate incoming quantity (moves to the stock location)
-                        incoming_moves = self.env['stock.move'].search([
-                            ('product_id', '=', line.product_id.id),
-                            ('location_dest_id', '=', stock_location.id),
-                            ('state', 'in', ['draft', 'waiting', 'confirmed', 'assigned'])
-                        ])
-                        incoming_qty = sum(incoming_moves.mapped('product_uom_qty'))
-                        
-                        # Calculate outgoing quantity (moves from the stock location)
-                        outgoing_moves = self.env['stock.move'].search([
-                            ('product_id', '=', line.product_id.id),
-                            ('location_id', '=', stock_location.id),
-                            ('state', 'in', ['draft', 'waiting', 'confirmed', 'assigned'])
-                        ])
-                        outgoing_qty = sum(outgoing_moves.mapped('product_uom_qty'))
-                        
-                        # Update fields according to FR-SCM-004
-                        line.available_qty = current_stock + incoming_qty - outgoing_qty  # Forecast quantity
+                values = data.get(line.product_id.id)
+                if values:
+                    # Forecast quantity: on-hand plus incoming minus outgoing
+                    line.available_qty = values['onhand'] + values['incoming'] - values['outgoing']
     
+    @api.model
+    def _load_inventory_data(self, session):
+        """Load the inventory figures of all the products of a session at once.
+
+        Returns a dict {product_id: values} where values holds the ``onhand``,
+        ``incoming`` and ``outgoing`` quantities of the warehouse stock
+        location and the ``safety_stock_qty`` and ``reorder_point`` of the
+        applicable inventory rule. Each session is loaded once and kept until
+        the end of the transaction.
+        """
+        data = self.env.cr.precommit.data.setdefault(INVENTORY_DATA_KEY, {})
+        if session.id not in data:
+            data[session.id] = self._read_inventory_data(session)
+        return data[session.id]
+
+    @api.model
+    def _read_inventory_data(self, session):
+        """Query the inventory figures returned by _load_inventory_data"""
+        products = session.consolidated_line_ids.mapped('product_id')
+        if not products:
+            return {}
+        warehouse = session.warehouse_id
+        stock_location = warehouse.lot_stock_id
+        rules = self.env['scm.inventory.rule'].get_applicable_rules(products, warehouse)
+
+        onhand, incoming, outgoing = {}, {}, {}
+        if stock_location:
+            # On-hand quantity of the stock location and its children, as qty_available
+            for product, quantity in self.env['stock.quant']._read_group(
+                [('product_id', 'in', products.ids), ('location_id', 'child_of', stock_location.id)],
+                groupby=['product_id'],
+                aggregates=['quantity:sum'],
+            ):
+                onhand[product.id] = quantity
+            # Open moves entering and leaving the stock location
+            move_domain = [
+                ('product_id', 'in', products.ids),
+                ('state', 'in', ['draft', 'waiting', 'confirmed', 'assigned']),
+            ]
+            for location_field, quantities in (('location_dest_id', incoming), ('location_id', outgoing)):
+                for product, quantity in self.env['stock.move']._read_group(
+                    move_domain + [(location_field, '=', stock_location.id)],
+                    groupby=['product_id'],
+                    aggregates=['product_uom_qty:sum'],
+                ):
+                    quantities[product.id] = quantity
+
+        return {
+            product.id: {
+                'onhand': onhand.get(product.id, 0.0),
+                'incoming': incoming.get(product.id, 0.0),
+                'outgoing': outgoing.get(product.id, 0.0),
+                'safety_stock_qty': rules[product.id].safety_stock_qty if rules[product.id] else 0.0,
+                'reorder_point': rules[product.id].reorder_point if rules[product.id] else 0.0,
+            }
+            for product in products
+        }
+
     def action_validate_inventory(self):
         self.ensure_one()
         _logger.info("Starting inventory validation")
@@ -241,57 +264,38 @@ class ValidateInventoryWizard(models.TransientModel):
         if 'line_ids' in fields_list and self.env.context.get('active_id'):
             consolidation = self.env['scm.pr.consolidation.session'].browse(self.env.context.get('active_id'))
             if consolidation:
-                # Get all consolidated lines
-                consolidated_lines = consolidation.consolidated_line_ids.filtered(
-                    lambda l: l.product_id.type in ['product', 'consu']
-                )
-                
-                # Create wizard line values
-                wizard_line_vals = []
-                for line in consolidated_lines:
-                    # Get inventory rule for safety stock and reorder point
-                    rule = self.env['scm.inventory.rule'].get_applicable_rule(
-                        line.product_id, 
-                        consolidation.warehouse_id
+                with self.env['scm.perf.trace']._trace(consolidation, 'inventory_validation') as trace:
+                    # Get all consolidated lines
+                    consolidated_lines = consolidation.consolidated_line_ids.filtered(
+                        lambda l: l.product_id.type in ['product', 'consu']
                     )
-                    
-                    # Get stock location
-                    stock_location = consolidation.warehouse_id.lot_stock_id
-                    
-                    # Calculate incoming quantity (moves to the stock location)
-                    incoming_moves = self.env['stock.move'].search([
-                        ('product_id', '=', line.product_id.id),
-                        ('location_dest_id', '=', stock_location.id),
-                        ('state', 'in', ['draft', 'waiting', 'confirmed', 'assigned'])
-                    ])
-                    incoming_qty = sum(incoming_moves.mapped('product_uom_qty'))
-                    
-                    # Calculate outgoing quantity (moves from the stock location)
-                    outgoing_moves = self.env['stock.move'].search([
-                        ('product_id', '=', line.product_id.id),
-                        ('location_id', '=', stock_location.id),
-                        ('state', 'in', ['draft', 'waiting', 'confirmed', 'assigned'])
-                    ])
-                    outgoing_qty = sum(outgoing_moves.mapped('product_uom_qty'))
-                    
-                    wizard_line_vals.append((0, 0, {
-                        'product_id': line.product_id.id,
-                        'product_uom_id': line.product_uom_id.id,
-                        'consolidated_line_id': line.id,
-                        'available_qty': line.available_quantity,
-                        'incoming_qty': incoming_qty,
-                        'outgoing_qty': outgoing_qty,
-                        'safety_stock_qty': rule.safety_stock_qty if rule else 0.0,
-                        'reorder_point': rule.reorder_point if rule else 0.0,
-                        'inventory_notes': line.notes or '',
-                    }))
                 
-                # Set values directly in res
-                res.update({
-                    'session_id': consolidation.id,
-                    'include_critical_only': any(wl[2].get('available_qty', 0) < wl[2].get('safety_stock_qty', 0) for wl in wizard_line_vals),
-                    'line_ids': wizard_line_vals
-                })
+                    # Load rules and stock moves of all the products at once
+                    data = self._load_inventory_data(consolidation)
+                
+                    # Create wizard line values
+                    wizard_line_vals = []
+                    for line in consolidated_lines:
+                        values = data[line.product_id.id]
+                        wizard_line_vals.append((0, 0, {
+                            'product_id': line.product_id.id,
+                            'product_uom_id': line.product_uom_id.id,
+                            'consolidated_line_id': line.id,
+                            'available_qty': line.available_quantity,
+                            'incoming_qty': values['incoming'],
+                            'outgoing_qty': values['outgoing'],
+                            'safety_stock_qty': values['safety_stock_qty'],
+                            'reorder_point': values['reorder_point'],
+                            'inventory_notes': line.notes or '',
+                        }))
+                
+                    # Set values directly in res
+                    res.update({
+                        'session_id': consolidation.id,
+                        'include_critical_only': any(wl[2].get('available_qty', 0) < wl[2].get('safety_stock_qty', 0) for wl in wizard_line_vals),
+                        'line_ids': wizard_line_vals
+                    })
+                    trace['records'] = len(wizard_line_vals)
         return res
 
 class ValidateInventoryWizardLine(models.TransientModel):
@@ -359,37 +363,15 @@ class ValidateInventoryWizardLine(models.TransientModel):
     
     @api.depends('product_id', 'wizard_id.session_id.warehouse_id')
     def _compute_incoming_outgoing_qty(self):
+        # One dataset per wizard, shared by all its lines
+        data_by_wizard = {}
         for line in self:
-            if not line.product_id or not line.wizard_id.session_id.warehouse_id:
-                line.incoming_qty = 0.0
-                line.outgoing_qty = 0.0
-                continue
-                
-            warehouse = line.wizard_id.session_id.warehouse_id
-            stock_location = warehouse.lot_stock_id
-            
-            if not stock_location:
-                line.incoming_qty = 0.0
-                line.outgoing_qty = 0.0
-                continue
-                
-            # Calculate incoming quantity (moves to the stock location)
-            incoming_moves = self.env['stock.move'].search([
-                ('product_id', '=', line.product_id.id),
-                ('location_dest_id', '=', stock_location.id),
-                ('state', 'in', ['draft', 'waiting', 'confirmed', 'assigned'])
-            ])
-            line.incoming_qty = sum(incoming_moves.mapped('product_uom_qty'))
-            
-            # Calculate outgoing quantity (moves from the stock location)
-            outgoing_moves = self.env['stock.move'].search([
-                ('product_id', '=', line.product_id.id),
-                ('location_id', '=', stock_location.id),
-                ('state', 'in', ['draft', 'waiting', 'confirmed', 'assigned'])
-            ])
-            line.outgoing_qty = sum(outgoing_moves.mapped('product_uom_qty'))
-            
-            _logger.info(f"Product {line.product_id.name}: Incoming={line.incoming_qty}, Outgoing={line.outgoing_qty}")
+            wizard = line.wizard_id
+            if wizard not in data_by_wizard:
+                data_by_wizard[wizard] = wizard._load_inventory_data(wizard.session_id) if wizard.session_id else {}
+            values = data_by_wizard[wizard].get(line.product_id.id, {})
+            line.incoming_qty = values.get('incoming', 0.0)
+            line.outgoing_qty = values.get('outgoing', 0.0)
     
     @api.depends('available_qty', 'incoming_qty', 'outgoing_qty')
     def _compute_forecasted_qty(self):
@@ -437,58 +419,6 @@ class ValidateInventoryWizardLine(models.TransientModel):
                 line.quantity_to_purchase = max(0, line.consolidated_line_id.total_quantity - line.available_qty)
             else:
                 line.quantity_to_purchase = 0.0
-    
-    @api.model
-    def default_get(self, fields_list):
-        res = super().default_get(fields_list)
-        if 'line_ids' in fields_list and self.env.context.get('active_id'):
-            session = self.env['scm.pr.consolidation.session'].browse(self.env.context.get('active_id'))
-            if session.consolidated_line_ids:
-                line_vals = []
-                for line in session.consolidated_line_ids:
-                    # Get inventory levels
-                    available_qty = line.product_id.with_context(
-                        location=session.warehouse_id.lot_stock_id.id
-                    ).qty_available
-                    
-                    # Get inventory rule
-                    rule = self.env['scm.inventory.rule'].get_applicable_rule(
-                        line.product_id, 
-                        session.warehouse_id
-                    )
-                    
-                    # Calculate expected receipt (incoming moves)
-                    stock_location = session.warehouse_id.lot_stock_id
-                    incoming_moves = self.env['stock.move'].search([
-                        ('product_id', '=', line.product_id.id),
-                        ('location_dest_id', '=', stock_location.id),
-                        ('state', 'in', ['draft', 'waiting', 'confirmed', 'assigned'])
-                    ])
-                    incoming_qty = sum(incoming_moves.mapped('product_uom_qty'))
-                    
-                    # Calculate outgoing quantity (moves from the stock location)
-                    outgoing_moves = self.env['stock.move'].search([
-                        ('product_id', '=', line.product_id.id),
-                        ('location_id', '=', stock_location.id),
-                        ('state', 'in', ['draft', 'waiting', 'confirmed', 'assigned'])
-                    ])
-                    outgoing_qty = sum(outgoing_moves.mapped('product_uom_qty'))
-                    
-                    # Calculate available quantity including incoming and outgoing
-                    available_qty = available_qty + incoming_qty - outgoing_qty
-                    
-                    line_vals.append((0, 0, {
-                        'product_id': line.product_id.id,
-                        'product_uom_id': line.product_uom_id.id,
-                        'consolidated_line_id': line.id,
-                        'available_qty': available_qty,
-                        'safety_stock_qty': rule.safety_stock_qty if rule else 0.0,
-                        'reorder_point': rule.reorder_point if rule else 0.0,
-                    }))
-                
-                if line_vals:
-                    res['line_ids'] = line_vals
-        return res
 
 class RejectInventoryWizard(models.TransientModel):
     _name = 'reject.inventory.wizard'